@@ -0,0 +1,252 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+import search
+from graph_creator import create_knowledge_graph, documents_fingerprint, update_document
+from graph_snapshot import load_compact_snapshot, load_snapshot, save_snapshot
+from llm_backend import LocalBackend, set_backend
+from model.frontier import Frontier
+from model.graph import KnowledgeGraph, graph_differences
+from model.graph_view import permitted_view
+from model.path import Path
+from model.permissions import compile_permissions
+from path_finding import connecting_paths
+from synthetic_graph import synthetic_extractions, synthetic_graph
+
+# Offline benchmarks for the graph code. Every LLM call goes to the local stand-in backend, so results only
+# reflect local work (plus any simulated latency):
+#   python src/benchmark.py --entities 5000 --degree 6 --power-law 2.2 --json before.json
+
+def measure(name: str, fn: Callable[[], object], repeat: int = 3) -> dict:
+    # Times fn (best and median of `repeat` runs), then runs it once more under tracemalloc for peak memory
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"name": name, "best_seconds": min(timings), "median_seconds": statistics.median(timings), "peak_bytes": peak}
+
+@contextlib.contextmanager
+def scratch_directory():
+    # Runs the block in an empty working directory, so the on-disk caches start cold and nothing is left behind
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            yield scratch
+        finally:
+            os.chdir(cwd)
+
+def sample_nodes(graph: KnowledgeGraph, count: int, seed: int) -> List[str]:
+    # The biggest hubs plus random nodes, since both extremes matter for option generation
+    hubs = sorted(graph, key=lambda name: -len(graph[name].edges))[:count // 2]
+    rest = random.Random(seed).sample(list(graph), min(len(graph), count - len(hubs)))
+    return hubs + rest
+
+def build_frontiers(graph: KnowledgeGraph, starts: List[str], depth: int, permission_mask: int, seed: int) -> List[Frontier]:
+    # Replays the frontier work of a bfs without the model: from each start, repeatedly take a random option
+    rng = random.Random(seed)
+    frontiers = []
+    for name in starts:
+        path = Path()
+        path.add_node(graph[name])
+        visited = {graph[name]}
+        frontier = Frontier(graph, permission_mask)
+        frontier.expand(path, visited)
+        for _ in range(depth - 1):
+            options = frontier.to_list()
+            if not options:
+                break
+            path = rng.choice(options)
+            visited.add(path.last_node())
+            frontier.visit(path.last_node())
+            frontier.expand(path, visited)
+        frontiers.append(frontier)
+    return frontiers
+
+def run_benchmarks(num_entities: int = 1000, avg_degree: float = 4.0, power_law_exponent: Optional[float] = 2.5,
+                   facts_per_node: int = 3, num_documents: int = 10, documents_per_entity: int = 1,
+                   permitted_documents: Optional[int] = None, depth: int = 5, samples: int = 20,
+                   layout_entities: int = 100, latency: float = 0.0, max_workers: int = 1, repeat: int = 3,
+                   only: Optional[List[str]] = None, seed: int = 0, beam_width: int = 1, branches: int = 1) -> List[dict]:
+    extractions = synthetic_extractions(num_entities, avg_degree, power_law_exponent, facts_per_node, num_documents,
+                                        documents_per_entity, seed)
+    graph = synthetic_graph(extractions)
+    # Searches see the first `permitted_documents` documents (all of them by default)
+    permissions = set(range(permitted_documents)) if permitted_documents is not None else {-1}
+    permission_mask = compile_permissions(permissions)
+    starts = sample_nodes(graph, samples, seed)
+    benchmarks: Dict[str, Callable[[], object]] = {}
+    # Untimed preparation for a benchmark, only run if it is selected
+    setups: Dict[str, Callable[[], object]] = {}
+
+    benchmarks["merge"] = lambda: synthetic_graph(extractions)
+
+    # The whole pipeline against the stand-in backend, with a cold extraction cache in a scratch directory
+    documents = {doc_id: f"Synthetic document {doc_id}" for doc_id in extractions}
+    responses = {content: extractions[doc_id] for doc_id, content in documents.items()}
+    def create():
+        set_backend(LocalBackend(responder=lambda messages, _: responses[messages[-1]["content"]], latency=latency))
+        with scratch_directory():
+            return create_knowledge_graph(documents, max_workers=max_workers)
+    benchmarks["create_knowledge_graph"] = create
+
+    # Replacing a document in a live graph and putting it back. The replacement writes the entities in lower case,
+    # so the update merges them into the names other documents use and restoring it retracts those aliases again.
+    # Before timing, both updates are checked against a full build of the same documents.
+    first_doc = next(iter(documents))
+    lower_content = f"{documents[first_doc]}, in lower case"
+    extraction = extractions[first_doc]
+    responses[lower_content] = {
+        "entities": [{**entity, "name": entity["name"].lower()} for entity in extraction["entities"]],
+        "relationships": [{**rel, "source_entity": rel["source_entity"].lower(), "target_entity": rel["target_entity"].lower()}
+                          for rel in extraction["relationships"]],
+    }
+    live_graph = None
+    def check_updates():
+        nonlocal live_graph
+        set_backend(LocalBackend(responder=lambda messages, _: responses[messages[-1]["content"]], latency=latency))
+        with scratch_directory(), contextlib.redirect_stdout(io.StringIO()):
+            live_graph = create_knowledge_graph(documents)
+            for content in (lower_content, documents[first_doc]):
+                update_document(live_graph, first_doc, content)
+                differences = graph_differences(create_knowledge_graph({**documents, first_doc: content}), live_graph)
+                if differences:
+                    raise RuntimeError(f"Updating document {first_doc} doesn't give the full build's graph: {differences}")
+    setups["update_document"] = check_updates
+    def update():
+        with scratch_directory():
+            update_document(live_graph, first_doc, lower_content)
+            update_document(live_graph, first_doc, documents[first_doc])
+    benchmarks["update_document"] = update
+
+    # Loading the graph back from a snapshot, as Nodes and as a CompactGraph. The loaded graph is still alive when
+    # peak memory is read, so the two peaks compare what each representation holds
+    snapshot_directory = tempfile.TemporaryDirectory()
+    snapshot_path = os.path.join(snapshot_directory.name, "graph.snapshot")
+    def write_snapshot():
+        if not os.path.exists(snapshot_path):
+            save_snapshot(graph, snapshot_path, documents_fingerprint(documents))
+    setups["snapshot_load"] = setups["compact_snapshot_load"] = write_snapshot
+    benchmarks["snapshot_load"] = lambda: load_snapshot(snapshot_path)
+    benchmarks["compact_snapshot_load"] = lambda: load_compact_snapshot(snapshot_path)
+
+    benchmarks["frontier"] = lambda: build_frontiers(graph, starts, depth, permission_mask, seed)
+
+    options = [option for frontier in build_frontiers(graph, starts, depth, permission_mask, seed) for option in frontier.to_list()]
+    benchmarks["to_string"] = lambda: [option.to_string(permission_mask) for option in options]
+
+    # Local paths between pairs of the sampled entities, as searches naming two entities find them
+    pairs = list(zip(starts, reversed(starts)))[:len(starts) // 2]
+    benchmarks["path_finding"] = lambda: [connecting_paths(permitted_view(graph, permission_mask), list(pair), permission_mask)
+                                          for pair in pairs]
+
+    def bfs():
+        set_backend(LocalBackend(latency=latency))
+        cache, search.response_cache = search.response_cache, None
+        try:
+            for name in starts:
+                path = Path()
+                path.add_node(graph[name])
+                search.bfs(graph, f"What is {name} connected to?", [path], {graph[name]}, depth, [], permissions,
+                           beam_width=beam_width, branches=branches)
+        finally:
+            search.response_cache = cache
+    benchmarks["bfs"] = bfs
+
+    small_extractions = synthetic_extractions(layout_entities, avg_degree, power_law_exponent, facts_per_node, num_documents,
+                                              documents_per_entity, seed)
+    def layout():
+        # A fresh graph in a scratch directory, so neither the in-memory nor the on-disk layout cache helps
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        from visualization_tool import get_knowledge_graph
+        with scratch_directory():
+            fig = get_knowledge_graph(synthetic_graph(small_extractions), None, permissions)
+            fig.canvas.draw()
+            plt.close(fig)
+    benchmarks["layout"] = layout
+
+    # What a permission change or finished search costs once the graph is on screen
+    recolor_figure = None
+    def draw_figure():
+        nonlocal recolor_figure
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        from visualization_tool import GraphFigure
+        with scratch_directory():
+            recolor_figure = GraphFigure(synthetic_graph(small_extractions), plt.subplots(figsize=(14, 10))[1])
+        recolor_figure.ax.figure.canvas.draw()
+    setups["recolor"] = draw_figure
+    def recolor():
+        recolor_figure.recolor(None, permissions)
+        recolor_figure.ax.figure.canvas.draw()
+    benchmarks["recolor"] = recolor
+
+    results = []
+    try:
+        for name, fn in benchmarks.items():
+            if only is None or name in only:
+                if name in setups:
+                    setups[name]()
+                results.append(measure(name, fn, repeat))
+    finally:
+        set_backend(None)
+        snapshot_directory.cleanup()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the knowledge graph code on synthetic data")
+    parser.add_argument("--entities", type=int, default=1000)
+    parser.add_argument("--degree", type=float, default=4.0, help="average number of relationships per entity")
+    parser.add_argument("--power-law", type=float, default=2.5, help="degree distribution exponent (0 for uniform)")
+    parser.add_argument("--facts", type=int, default=3, help="facts per entity")
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--documents-per-entity", type=int, default=1)
+    parser.add_argument("--permitted-documents", type=int, default=None, help="documents searches may see (default all)")
+    parser.add_argument("--depth", type=int, default=5, help="bfs steps per search")
+    parser.add_argument("--samples", type=int, default=20, help="start nodes for frontier, rendering and bfs benchmarks")
+    parser.add_argument("--layout-entities", type=int, default=100)
+    parser.add_argument("--beam-width", type=int, default=1, help="options the bfs benchmark takes per LLM call")
+    parser.add_argument("--branches", type=int, default=1, help="parallel LLM calls per bfs step")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per LLM call")
+    parser.add_argument("--workers", type=int, default=1, help="extraction workers")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="*", help="benchmarks to run (merge, create_knowledge_graph, update_document, "
+                                                  "snapshot_load, compact_snapshot_load, frontier, to_string, path_finding, bfs, layout, "
+                                                  "recolor)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.entities, args.degree, args.power_law or None, args.facts, args.documents,
+                             args.documents_per_entity, args.permitted_documents, args.depth, args.samples,
+                             args.layout_entities, args.latency, args.workers, args.repeat, args.only, args.seed,
+                             args.beam_width, args.branches)
+    print(f"{'benchmark':<24}{'best ms':>12}{'median ms':>12}{'peak MB':>12}")
+    for result in results:
+        print(f"{result['name']:<24}{result['best_seconds'] * 1000:>12.1f}{result['median_seconds'] * 1000:>12.1f}"
+              f"{result['peak_bytes'] / 2 ** 20:>12.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"parameters": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import hashlib
+import re
+from typing import List
+
+DEFAULT_CHUNK_CHARS = 12000
+DEFAULT_CHUNK_OVERLAP = 500
+
+# Blank lines and markdown-style headings are the natural places to cut a document
+_BLOCK_PATTERN = re.compile(r"\n\s*\n|\n(?=#)")
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+def _split_block(block: str, max_chars: int) -> List[str]:
+    # A single paragraph longer than a chunk is cut between sentences, and only hard cut as a last resort
+    pieces = []
+    current = ""
+    for sentence in _SENTENCE_PATTERN.split(block):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+def _is_cut_point(block: str, target_chars: int) -> bool:
+    # Content-defined boundary: whether a chunk may end after this block depends only on the block's own text,
+    # with a chance proportional to its length, so chunks average about target_chars
+    digest = hashlib.blake2b(block.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64 < len(block) / target_chars
+
+def chunk_document(content: str, max_chars: int = DEFAULT_CHUNK_CHARS, overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[str]:
+    # Splits a document into chunks of at most about max_chars on paragraph and heading boundaries. Each chunk
+    # after the first starts with up to `overlap` characters of trailing blocks from the previous chunk, so
+    # relationships spanning a boundary are still seen together.
+    # Boundaries are anchored on content rather than on position: a chunk ends before a heading, after a block
+    # whose text marks a cut point (see _is_cut_point), or when it would outgrow max_chars. Inserting, removing
+    # or editing text therefore only changes the chunk it falls in (and the overlap carried into the next one),
+    # and every other chunk, with its cached extraction, stays the same.
+    if len(content) <= max_chars:
+        return [content]
+
+    blocks = []
+    for block in _BLOCK_PATTERN.split(content):
+        block = block.strip()
+        if block:
+            blocks.extend(_split_block(block, max_chars) if len(block) > max_chars else [block])
+
+    # Chunks average about half of max_chars, so the size limit rarely has to force a cut, and very small
+    # chunks are avoided by ignoring cut points until a chunk has some content
+    target_chars = max_chars // 2
+    min_chars = max_chars // 8
+
+    chunks = []
+    current: List[str] = []
+    # Sizes count only the chunk's own blocks, not the carried overlap, so cuts don't depend on the previous chunk
+    size = 0
+    carried_size = 0
+    def cut() -> None:
+        nonlocal current, size, carried_size
+        chunks.append("\n\n".join(current))
+        # Carry the tail of this chunk into the next one
+        carried: List[str] = []
+        carried_size = 0
+        for previous in reversed(current):
+            if carried_size + len(previous) > overlap:
+                break
+            carried.insert(0, previous)
+            carried_size += len(previous) + 2
+        current, size = carried, 0
+
+    for block in blocks:
+        if size and (size + carried_size + len(block) + 2 > max_chars or (block.startswith("#") and size >= min_chars)):
+            cut()
+        current.append(block)
+        size += len(block) + 2
+        if size >= min_chars and _is_cut_point(block, target_chars):
+            cut()
+    if size:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def merge_extractions(infos: List[dict]) -> dict:
+    # Combines per-chunk extractions into one per-document result: entities found in several chunks are
+    # merged with their descriptors, and repeated relationships are kept once
+    entities = {}
+    relationships = {}
+    for info in infos:
+        for entity in info['entities']:
+            merged = entities.setdefault(entity['name'], {'name': entity['name'], 'descriptors_not_relationships': []})
+            for descriptor in entity['descriptors_not_relationships']:
+                if descriptor not in merged['descriptors_not_relationships']:
+                    merged['descriptors_not_relationships'].append(descriptor)
+        for rel in info['relationships']:
+            key = (rel['source_entity'], rel['target_entity'], rel['relationship_from_source_to_target'])
+            relationships.setdefault(key, rel)
+    return {'entities': list(entities.values()), 'relationships': list(relationships.values())}
@@ -0,0 +1,92 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+from model.graph import derived_data, resolve_alias
+from model.names import normalize
+
+def trigrams(text: str) -> Set[str]:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class EntityIndex:
+    # Local lookup of the entities a query mentions, so source node selection only has to consider a
+    # handful of names instead of the whole graph:
+    # - exact: normalized entity names and aliases, matched against every word n-gram of the query
+    # - fuzzy: character trigrams, scoring how much of each name appears in the query
+    def __init__(self, names: Iterable[str], aliases: Optional[Mapping[str, str]] = None, max_posting: int = 1000):
+        self.exact: Dict[str, Set[str]] = {}
+        self.grams: Dict[str, Set[str]] = {}
+        self.gram_counts: Dict[str, int] = {}
+        self.max_words = 1
+        self.max_posting = max_posting
+
+        for name in names:
+            self._add(name, name)
+        for alias, name in (aliases or {}).items():
+            self._add(alias, name)
+
+    def _add(self, text: str, name: str) -> None:
+        key = normalize(text)
+        if not key:
+            return
+        self.exact.setdefault(key, set()).add(name)
+        self.max_words = max(self.max_words, key.count(" ") + 1)
+        grams = trigrams(key)
+        self.gram_counts[name] = max(self.gram_counts.get(name, 0), len(grams))
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(name)
+
+    def exact_matches(self, query: str) -> List[Tuple[str, int, int]]:
+        # Returns (entity name, start word, end word) for every entity whose name appears verbatim in the query
+        words = normalize(query).split()
+        matches = []
+        for start in range(len(words)):
+            for end in range(start + 1, min(len(words), start + self.max_words) + 1):
+                for name in self.exact.get(" ".join(words[start:end]), ()):
+                    matches.append((name, start, end))
+        return matches
+
+    def mentioned(self, query: str) -> List[str]:
+        # Entities mentioned in the query, ignoring matches inside a longer match ("Sue" in "Sue Smith")
+        matches = self.exact_matches(query)
+        mentioned = []
+        for name, start, end in sorted(matches, key=lambda m: m[1] - m[2]):
+            contained = any(s <= start and end <= e and (e - s) > (end - start) for _, s, e in matches)
+            if not contained and name not in mentioned:
+                mentioned.append(name)
+        return mentioned
+
+    def unambiguous_match(self, query: str) -> Optional[str]:
+        mentioned = self.mentioned(query)
+        return mentioned[0] if len(mentioned) == 1 else None
+
+    def lookup(self, query: str, limit: int = 20, min_score: float = 0.5) -> List[str]:
+        # Shortlist of likely source entities: exact mentions first, then the best fuzzy matches
+        candidates = self.mentioned(query)
+        if len(candidates) >= limit:
+            return candidates[:limit]
+
+        shared: Counter = Counter()
+        for gram in trigrams(normalize(query)):
+            posting = self.grams.get(gram, ())
+            # Very common trigrams say little about which entity is meant and would make lookups linear
+            if len(posting) <= self.max_posting:
+                shared.update(posting)
+        scored = sorted(((count / self.gram_counts[name], name) for name, count in shared.items()), key=lambda s: (-s[0], s[1]))
+        for score, name in scored:
+            if len(candidates) >= limit or score < min_score:
+                break
+            if name not in candidates:
+                candidates.append(name)
+        return candidates
+
+def get_entity_index(graph: Mapping) -> EntityIndex:
+    # Builds the index for a graph once per graph version (see derived_data)
+    def build(_) -> EntityIndex:
+        graph_aliases = getattr(graph, 'aliases', None) or {}
+        aliases = {}
+        for alias in graph_aliases:
+            name = resolve_alias(graph_aliases, alias)
+            if name in graph:
+                aliases[alias] = name
+        return EntityIndex(graph.keys(), aliases)
+    return derived_data(graph, 'entity_index', build)
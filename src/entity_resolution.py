@@ -0,0 +1,121 @@
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from model.graph import KnowledgeGraph
+from model.names import resolution_key
+
+# Names with more distinct words than this are only matched on their full key, which bounds the
+# blocking work per name (2^words subsets)
+MAX_SUBSET_WORDS = 6
+
+def candidate_pairs(keys: Iterable[str]) -> Set[Tuple[str, str]]:
+    # Blocking: rather than comparing names pairwise, every key looks up the keys made of a proper subset
+    # of its words, so finding all (shorter, longer) pairs like ("sue", "smith sue") is linear in the
+    # number of names
+    keys = set(keys)
+    pairs = set()
+    for key in keys:
+        words = key.split()
+        if len(words) > MAX_SUBSET_WORDS:
+            continue
+        for size in range(1, len(words)):
+            for subset in combinations(words, size):
+                shorter = " ".join(subset)
+                if shorter in keys:
+                    pairs.add((shorter, key))
+    return pairs
+
+def related_pairs(graph: KnowledgeGraph, keys: Iterable[str]) -> Set[Tuple[str, str]]:
+    # The pairs candidate_pairs would find over the whole graph that decide whether the given keys merge: every
+    # key and every key made of a subset of its words, each paired with all of its supersets. Supersets are the
+    # keys holding all of a key's words, found by intersecting the graph's keys_by_word sets.
+    shorts = set()
+    for key in keys:
+        shorts.add(key)
+        words = key.split()
+        if len(words) > MAX_SUBSET_WORDS:
+            continue
+        for size in range(1, len(words)):
+            for subset in combinations(words, size):
+                shorter = " ".join(subset)
+                if shorter in graph.names_by_key:
+                    shorts.add(shorter)
+    pairs = set()
+    for short in shorts:
+        word_keys = sorted((graph.keys_by_word.get(word, set()) for word in short.split()), key=len)
+        for longer in set.intersection(*word_keys) if word_keys else ():
+            if longer != short and len(longer.split()) <= MAX_SUBSET_WORDS:
+                pairs.add((short, longer))
+    return pairs
+
+def corroborated(graph: KnowledgeGraph, names_by_key: Dict[str, List[str]], short: str, long: str,
+                 min_shared_neighbors: int) -> bool:
+    # Whether two names are seen together: in at least one shared document, with enough neighbors in common
+    # (neighbors are compared by resolution key, and the two names themselves don't count)
+    short_nodes = [graph[name] for name in names_by_key[short]]
+    long_nodes = [graph[name] for name in names_by_key[long]]
+    if not set().union(*(node.documents for node in short_nodes)) & set().union(*(node.documents for node in long_nodes)):
+        return False
+    def neighbor_keys(nodes) -> Set[str]:
+        return {resolution_key(target.name) for node in nodes for target in node.edges} - {short, long}
+    return len(neighbor_keys(short_nodes) & neighbor_keys(long_nodes)) >= min_shared_neighbors
+
+def resolve_entities(graph: KnowledgeGraph, merge_subsets: bool = False, names: Optional[Iterable[str]] = None,
+                     min_shared_neighbors: int = 1) -> Dict[str, str]:
+    # Folds duplicate entities into one node and returns {merged name: kept name}. Names are duplicates if
+    # they share a resolution key. With merge_subsets, a name whose words are contained in exactly one other
+    # entity's name ("Sue" and "Sue Smith") is also folded into it, but only when the two appear in a shared
+    # document and have at least min_shared_neighbors neighbors in common, since a unique superset alone
+    # ("New York" next to "New York Times") says little. With `names`, only duplicates of those names are
+    # resolved, which is what an incremental update needs.
+    if names is None:
+        keys = set(graph.names_by_key)
+        touched = None
+    else:
+        keys = {resolution_key(name) for name in names if name in graph} - {""}
+        touched = set(keys)
+
+    supersets: Dict[str, Set[str]] = {}
+    if merge_subsets:
+        for shorter, longer in candidate_pairs(keys) if touched is None else related_pairs(graph, touched):
+            supersets.setdefault(shorter, set()).add(longer)
+            keys.update((shorter, longer))
+    names_by_key = {key: list(graph.names_by_key[key]) for key in keys}
+
+    parent = {key: key for key in keys}
+    def find(key: str) -> str:
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    # Longest names first, so "Sue" next to "Sue Smith" and "Sue Smith Jr" sees them as one entity
+    for short in sorted(supersets, key=lambda key: (-len(key.split()), key)):
+        if touched is not None and short not in touched and not supersets[short] & touched:
+            continue
+        roots = {find(key) for key in supersets[short]}
+        if len(roots) == 1 and any(corroborated(graph, names_by_key, short, longer, min_shared_neighbors)
+                                   for longer in supersets[short]):
+            parent[find(short)] = roots.pop()
+
+    groups: Dict[str, List[str]] = {}
+    touched_roots = None if touched is None else {find(key) for key in touched}
+    for key, key_names in names_by_key.items():
+        root = find(key)
+        if touched_roots is None or root in touched_roots:
+            groups.setdefault(root, []).extend(key_names)
+
+    merged = {}
+    for group in groups.values():
+        # Keep the best ranked name any of the group's entities goes by (see KnowledgeGraph.name_rank), so the
+        # name depends only on what the documents say now and not on the order they were added in
+        keep = min(group, key=graph.name_rank)
+        for name in group:
+            if name != keep:
+                graph.merge_nodes(keep, name)
+        preferred = graph.preferred_name(keep)
+        if preferred != keep:
+            graph.rename_node(keep, preferred)
+        for name in group:
+            if name != preferred:
+                merged[name] = preferred
+    return merged
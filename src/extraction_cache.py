@@ -0,0 +1,134 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Optional, Tuple
+
+DEFAULT_CACHE_DIR = "src/graph_info"
+
+# mkstemp creates files readable only by their owner; files renamed into place get the mode a plain open()
+# would have given them. The umask can only be read by setting it, so that is done once, at import.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+class ExtractionCache:
+    # Extraction results keyed by a hash of everything that determines them (document content,
+    # prompt, schema and model), so renaming or reordering documents never serves the wrong entry.
+    # Entries live in two levels of shard directories (ab/cd/abcd....json) to keep each directory small.
+    def __init__(self, root: str = DEFAULT_CACHE_DIR):
+        self.root = root
+
+    @staticmethod
+    def key(content: str, prompt: str, model: str, schema: str = "") -> str:
+        digest = hashlib.sha256()
+        for part in (model, prompt, schema, content):
+            encoded = part.encode("utf-8")
+            # Length-prefix each part so different splits of the same bytes can't collide
+            digest.update(len(encoded).to_bytes(8, "little"))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                info = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # ValueError covers JSON and UTF-8 decoding errors: a damaged entry is a miss
+            return None
+        # Refresh the modification time so age-based eviction drops the least recently used entries
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return info
+
+    def put(self, key: str, info_json: str) -> None:
+        path = self.path(key)
+        dir_path = os.path.dirname(path)
+        os.makedirs(dir_path, exist_ok=True)
+        # Write to a temporary file and rename it into place so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(info_json)
+            os.chmod(tmp_path, FILE_MODE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def entries(self):
+        # Yields (path, size, mtime) for every cache entry
+        if not os.path.isdir(self.root):
+            return
+        for shard in os.listdir(self.root):
+            shard_path = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_path):
+                continue
+            for sub_shard in os.listdir(shard_path):
+                sub_path = os.path.join(shard_path, sub_shard)
+                if not os.path.isdir(sub_path):
+                    continue
+                for filename in os.listdir(sub_path):
+                    if filename.endswith(".json"):
+                        path = os.path.join(sub_path, filename)
+                        stat = os.stat(path)
+                        yield path, stat.st_size, stat.st_mtime
+
+    def evict(self, max_bytes: Optional[int] = None, max_age_seconds: Optional[float] = None) -> Tuple[int, int]:
+        # Removes entries older than max_age_seconds, then the least recently used entries until
+        # the cache fits in max_bytes. Returns (entries removed, bytes freed).
+        now = time.time()
+        kept = []
+        removed = freed = 0
+        for path, size, mtime in self.entries():
+            if max_age_seconds is not None and now - mtime > max_age_seconds:
+                os.remove(path)
+                removed += 1
+                freed += size
+            else:
+                kept.append((mtime, size, path))
+
+        if max_bytes is not None:
+            total = sum(size for _, size, _ in kept)
+            kept.sort()
+            for mtime, size, path in kept:
+                if total <= max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+                removed += 1
+                freed += size
+
+        return removed, freed
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the extraction cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    evict_parser = subparsers.add_parser("evict", help="Remove old entries or shrink the cache to a size limit")
+    evict_parser.add_argument("--max-size-mb", type=float, default=None)
+    evict_parser.add_argument("--max-age-days", type=float, default=None)
+    subparsers.add_parser("stats", help="Show the number of entries and total size")
+    args = parser.parse_args()
+
+    cache = ExtractionCache(args.cache_dir)
+    if args.command == "evict":
+        max_bytes = int(args.max_size_mb * 1024 * 1024) if args.max_size_mb is not None else None
+        max_age = args.max_age_days * 24 * 60 * 60 if args.max_age_days is not None else None
+        removed, freed = cache.evict(max_bytes, max_age)
+        print(f"Removed {removed} entries ({freed / (1024 * 1024):.1f} MB)")
+    else:
+        sizes = [size for _, size, _ in cache.entries()]
+        print(f"{len(sizes)} entries ({sum(sizes) / (1024 * 1024):.1f} MB)")
+
+if __name__ == "__main__":
+    main()
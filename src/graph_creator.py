@@ -1,118 +1,223 @@
+import hashlib
 import os
-from typing import Dict, List
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Union
 from pydantic import BaseModel
-from dotenv import load_dotenv
-from model.node import Node
-from model.relationship import Relationship
+from model.compact_graph import CompactGraph
+from model.graph import KnowledgeGraph, resolve_alias
+from llm_backend import cache_model, get_backend
+from tracing import propagate, span
+from rate_limiter import RateLimiter, estimate_tokens, retry_with_backoff
+from extraction_cache import ExtractionCache
+from graph_snapshot import load_compact_snapshot, load_snapshot, save_snapshot
+from entity_resolution import resolve_entities as resolve_duplicate_entities
+from chunking import DEFAULT_CHUNK_OVERLAP, chunk_document, merge_extractions
+from prompts.extraction_prompts import EXTRACTION_SYSTEM_PROMPT
 import json
 
-# Load environment variables
-load_dotenv()
-
-# Set up OpenAI API key
-OpenAI.api_key = os.getenv("OPENAI_API_KEY")
-
-# Initialize OpenAI client
-client = OpenAI()
-
-def create_knowledge_graph(documents: Dict[int, str]) -> Dict[str, Node]:
-    graph: Dict[str, Node] = {}
-
-    print("Extracting entities and relationships from documents...")
+EXTRACTION_MODEL = "gpt-4o-2024-08-06"
+
+class ExtractedEntity(BaseModel):
+    name: str
+    descriptors_not_relationships: list[str]
+
+class ExtractedRelationship(BaseModel):
+    source_entity: str
+    target_entity: str
+    relationship_from_source_to_target: str
+
+class ExtractedInformation(BaseModel):
+    entities: list[ExtractedEntity]
+    relationships: list[ExtractedRelationship]
+
+# Part of the cache key, so changing the extraction schema invalidates old results
+EXTRACTION_SCHEMA = json.dumps(ExtractedInformation.model_json_schema(), sort_keys=True)
+
+def create_knowledge_graph(documents: Dict[int, str], max_workers: int = 1, requests_per_minute: Optional[int] = None,
+                           tokens_per_minute: Optional[int] = None, max_retries: int = 5,
+                           snapshot_path: Optional[str] = None, resolve_entities: bool = True,
+                           chunk_chars: Optional[int] = None, chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                           merge_subsets: bool = False, compact: bool = False) -> Union[KnowledgeGraph, CompactGraph]:
+    # With compact the graph comes back as a read-only CompactGraph, loaded straight from the snapshot when there is one
+    with span("create_knowledge_graph", documents=len(documents)) as build_span:
+        # Reuse the merged graph from the last run if it was built from exactly these documents
+        if snapshot_path is not None:
+            with span("snapshot_load") as load_span:
+                fingerprint = documents_fingerprint(documents, resolve_entities, chunk_chars, chunk_overlap, merge_subsets)
+                graph = (load_compact_snapshot if compact else load_snapshot)(snapshot_path, fingerprint)
+                load_span.set(cache_hit=graph is not None)
+            if graph is not None:
+                print(f"Loaded knowledge graph snapshot from {snapshot_path}")
+                build_span.set(entities=len(graph))
+                return graph
+
+        graph = KnowledgeGraph()
+
+        print("Extracting entities and relationships from documents...")
+        rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        doc_infos = extract_documents(documents, max_workers, rate_limiter, max_retries, chunk_chars, chunk_overlap)
+
+        # Merge in the order the documents were given, not the order extractions finished,
+        # so the resulting graph is the same regardless of concurrency
+        with span("merge"):
+            for doc_id in documents:
+                merge_document(graph, doc_id, doc_infos[doc_id])
+
+        # Fold spelling variants of the same entity ("The Acme Corp.", "acme corp") into one node, and with
+        # merge_subsets also corroborated short names ("Sue" into "Sue Smith")
+        if resolve_entities:
+            with span("resolve_entities") as resolve_span:
+                merged = resolve_duplicate_entities(graph, merge_subsets)
+                resolve_span.set(merged=len(merged))
+            print(f"Merged {len(merged)} duplicate entities")
+
+        if snapshot_path is not None:
+            with span("snapshot_save"):
+                save_snapshot(graph, snapshot_path, fingerprint)
+
+        build_span.set(entities=len(graph))
+        return CompactGraph.from_graph(graph) if compact else graph
+
+def read_documents(documents_dir: str = "documents") -> Dict[int, str]:
+    documents = {}
+    document_id = 0
+    # Sorted so document ids (used for permissions) stay stable across platforms and runs
+    for filename in sorted(os.listdir(documents_dir)):
+        if filename.endswith(".txt"):
+            file_path = os.path.join(documents_dir, filename)
+            with open(file_path, 'r') as file:
+                documents[document_id] = file.read()
+            document_id += 1
+    return documents
+
+def documents_fingerprint(documents: Dict[int, str], resolve_entities: bool = True, chunk_chars: Optional[int] = None,
+                          chunk_overlap: int = DEFAULT_CHUNK_OVERLAP, merge_subsets: bool = False) -> bytes:
+    # Identifies a document set (ids, order and extraction inputs) and build options to decide whether a snapshot is stale
+    digest = hashlib.sha256()
+    digest.update(f"resolve_entities={resolve_entities},merge_subsets={merge_subsets},chunk_chars={chunk_chars},"
+                  f"chunk_overlap={chunk_overlap}\n".encode("utf-8"))
     for doc_id, content in documents.items():
-        print(f"Extracting entities and relationships from document {doc_id}...")
-        # Get the entities and relationships from the document
-        info_json = get_doc_info(doc_id, content)
-        
-        # Add nodes to the graph
-        for entity in info_json['entities']:
-            name = entity['name']
-            descriptors = entity['descriptors_not_relationships']
-            add_node(graph, name, descriptors, doc_id)
-        
-        # Add relationships to the graph
-        for rel in info_json['relationships']:
-            source = rel['source_entity']
-            target = rel['target_entity']
-            relator = rel['relationship_from_source_to_target']
-            if source not in graph:
-                add_node(graph, source, [], doc_id)
-            if target not in graph:
-                add_node(graph, target, [], doc_id)
-            proper_relationship = Relationship(relator, doc_id, False)
-            reverse_relationship = Relationship(relator, doc_id, True)
-            graph[source].add_relationship(graph[target], proper_relationship)
-            graph[target].add_relationship(graph[source], reverse_relationship)
-    
-    return graph
-
-def add_node(graph: Dict[str, Node], name: str, facts: List[str], doc_id: int) -> None:
-    if name not in graph:
-        graph[name] = Node(name)
-    graph[name].add_document(doc_id)
-    for fact in facts:
-        graph[name].add_fact(doc_id, fact)
-
-def get_doc_info(doc_id: int, content: str):
-    dir_path = "src/graph_info"
-    # Create the folder to save info if it doesn't exist
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
-
-    # Get the info from the file if it exists, otherwise extract it from the content and save it to the file
-    info_file = os.path.join(dir_path, f"{doc_id}.json")
-    if not os.path.exists(info_file):
-        info_json = extract_entities_and_relationships(content)
-        with open(info_file, 'w') as f:
-            f.write(info_json)
-
-    # Read the info from the file
-    with open(info_file, 'r') as f:
-        info_json = f.read()
-
-    # Return the info from the file
-    return json.loads(info_json)
-
-def extract_entities_and_relationships(content: str):
-
-    class Entity(BaseModel):
-        name: str
-        descriptors_not_relationships: list[str]
-
-    class Relationship(BaseModel):
-        source_entity: str
-        target_entity: str
-        relationship_from_source_to_target: str
-
-    class Information(BaseModel):
-        entities: list[Entity]
-        relationships: list[Relationship]
-
-    extrapolator_prompt = """
-    You are a helpful assistant that extracts entities and relationships from text.
-    
-    Guidelines:
-    - Descriptors: Include any adjectives or descriptive phrases that directly describe a singular entity (not a relationship between two).
-      Example: For "Jim is an old, fat man", "old" and "fat" are descriptors for Jim.
-    - Relationships: Create a relationship when one noun (person, place, or thing) is connected or possesses to another noun.
-      Example: For "Jim lives in New York City", create a relationship between Jim and New York City. For "Pam's favorite day of the week is Saturday", create a relationship between Pam and Saturday.
-    - Avoid listing general facts or actions as relationships unless they connect two distinct entities.
-    - If two entities are synonyms for each other, use the first word to describe it. If they are clearly distinct entities, there can remain distinct words.
-    
-    Please analyze the given text and extract entities and relationships accordingly.
-    """
-    
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "system", "content": extrapolator_prompt},
-            {"role": "user", "content": content}
-        ],
-        response_format=Information,
-    )
-
-    info = completion.choices[0].message.parsed
+        key = ExtractionCache.key(content, EXTRACTION_SYSTEM_PROMPT, cache_model(EXTRACTION_MODEL), EXTRACTION_SCHEMA)
+        digest.update(f"{doc_id}:{key}\n".encode("utf-8"))
+    return digest.digest()
+
+def merge_document(graph: KnowledgeGraph, doc_id: int, info_json: dict) -> None:
+    # Add nodes to the graph
+    for entity in info_json['entities']:
+        name = entity['name']
+        descriptors = entity['descriptors_not_relationships']
+        add_node(graph, name, descriptors, doc_id)
+
+    # Add relationships to the graph
+    for rel in info_json['relationships']:
+        source = rel['source_entity']
+        target = rel['target_entity']
+        relator = rel['relationship_from_source_to_target']
+        graph.add_relationship(source, target, relator, doc_id)
+
+def update_document(graph: KnowledgeGraph, doc_id: int, content: str, rate_limiter: Optional[RateLimiter] = None,
+                    max_retries: int = 5, chunk_chars: Optional[int] = None, chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                    resolve_entities: bool = True, merge_subsets: bool = False) -> Dict[str, str]:
+    # Replaces a document's contribution to a live graph (or adds a new document), then resolves the entities it
+    # mentions the way create_knowledge_graph would, and returns {merged name: kept name}. The result matches a full
+    # build, except that a merge_subsets merge a later change no longer corroborates stays until the next full build
+    # Extract first, so a failed extraction leaves the graph untouched
+    info_json = get_doc_info(doc_id, content, rate_limiter, max_retries, chunk_chars=chunk_chars, chunk_overlap=chunk_overlap)
+    graph.remove_document(doc_id)
+    merge_document(graph, doc_id, info_json)
+    if not resolve_entities:
+        return {}
+    # Names already merged away resolve to the kept entity, which may now have new duplicates
+    names = [entity['name'] for entity in info_json['entities']]
+    names += [name for rel in info_json['relationships'] for name in (rel['source_entity'], rel['target_entity'])]
+    return resolve_duplicate_entities(graph, merge_subsets, [resolve_alias(graph.aliases, name) for name in names])
+
+def remove_document(graph: KnowledgeGraph, doc_id: int) -> None:
+    graph.remove_document(doc_id)
+
+def add_node(graph: KnowledgeGraph, name: str, facts: List[str], doc_id: int) -> None:
+    graph.add_node(name, facts, doc_id)
+
+def extract_documents(documents: Dict[int, str], max_workers: int = 1, rate_limiter: Optional[RateLimiter] = None,
+                      max_retries: int = 5, chunk_chars: Optional[int] = None,
+                      chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> Dict[int, dict]:
+    # Get the entities and relationships from each document, running up to max_workers extractions at once
+    if max_workers <= 1:
+        doc_infos = {}
+        for doc_id, content in documents.items():
+            print(f"Extracting entities and relationships from document {doc_id}...")
+            doc_infos[doc_id] = get_doc_info(doc_id, content, rate_limiter, max_retries, chunk_chars=chunk_chars,
+                                             chunk_overlap=chunk_overlap)
+        return doc_infos
+
+    # Large documents are split here rather than in get_doc_info, so every chunk is a task on this one pool and
+    # no more than max_workers extractions are ever in flight
+    pieces = {doc_id: document_chunks(content, chunk_chars, chunk_overlap) for doc_id, content in documents.items()}
+    piece_infos: Dict[int, List[Optional[dict]]] = {doc_id: [None] * len(chunks) for doc_id, chunks in pieces.items()}
+    remaining = {doc_id: len(chunks) for doc_id, chunks in pieces.items()}
+    cache = ExtractionCache()
+    doc_infos = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # propagate keeps each worker's spans in the caller's trace
+        futures = {executor.submit(propagate(get_doc_info), doc_id, chunk, rate_limiter, max_retries, cache): (doc_id, i)
+                   for doc_id, chunks in pieces.items() for i, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            doc_id, i = futures[future]
+            piece_infos[doc_id][i] = future.result()
+            remaining[doc_id] -= 1
+            if not remaining[doc_id]:
+                infos = piece_infos[doc_id]
+                doc_infos[doc_id] = infos[0] if len(infos) == 1 else merge_extractions(infos)
+                print(f"Extracted entities and relationships from document {doc_id} ({len(doc_infos)}/{len(documents)})")
+    return doc_infos
+
+def document_chunks(content: str, chunk_chars: Optional[int], chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[str]:
+    # The pieces a document is extracted in: the whole document unless it is longer than chunk_chars
+    if chunk_chars is not None and len(content) > chunk_chars:
+        return chunk_document(content, chunk_chars, chunk_overlap)
+    return [content]
+
+def get_doc_info(doc_id: int, content: str, rate_limiter: Optional[RateLimiter] = None, max_retries: int = 5,
+                 cache: Optional[ExtractionCache] = None, chunk_chars: Optional[int] = None,
+                 chunk_overlap: int = DEFAULT_CHUNK_OVERLAP):
+    cache = cache or ExtractionCache()
+
+    with span("extract_document", doc_id=doc_id, chars=len(content)) as document_span:
+        # Large documents are extracted chunk by chunk (each chunk cached on its own) and merged, which keeps
+        # requests inside the context window and means an edit only re-extracts the chunks it touched
+        chunks = document_chunks(content, chunk_chars, chunk_overlap)
+        if len(chunks) > 1:
+            document_span.set(chunks=len(chunks))
+            return merge_extractions([get_doc_info(doc_id, chunk, rate_limiter, max_retries, cache) for chunk in chunks])
+
+        # Look the document up by its content (plus prompt, schema and model), so only new or changed documents are extracted
+        key = ExtractionCache.key(content, EXTRACTION_SYSTEM_PROMPT, cache_model(EXTRACTION_MODEL), EXTRACTION_SCHEMA)
+        info = cache.get(key)
+        document_span.set(cache_hit=info is not None)
+        if info is not None:
+            return info
+
+        info_json = extract_entities_and_relationships(content, rate_limiter, max_retries)
+        cache.put(key, info_json)
+        return json.loads(info_json)
+
+def extract_entities_and_relationships(content: str, rate_limiter: Optional[RateLimiter] = None, max_retries: int = 5):
+    backend = get_backend()
+
+    def request():
+        if rate_limiter is not None:
+            rate_limiter.acquire(estimate_tokens(EXTRACTION_SYSTEM_PROMPT) + estimate_tokens(content))
+        return backend.parse(
+            model=EXTRACTION_MODEL,
+            messages=[
+                {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            response_format=ExtractedInformation,
+        )
+
+    with span("llm", model=EXTRACTION_MODEL, response_format=ExtractedInformation.__name__):
+        info = retry_with_backoff(request, max_retries=max_retries, retry_on=backend.retryable_errors)
     info_json = json.dumps(info.model_dump(), indent=2)
     
-    return info_json
\ No newline at end of file
+    return info_json
@@ -0,0 +1,289 @@
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from typing import Dict, List, NamedTuple, Optional
+from extraction_cache import FILE_MODE
+from model.compact_graph import CompactGraph
+from model.graph import KnowledgeGraph
+from model.node import Node
+from model.relationship import Relationship
+from model.permissions import document_mask
+
+# On-disk layout (little endian, every section padded to 8 bytes so it can be viewed in place once mapped):
+#   header:   magic, format version, 32-byte document-set fingerprint
+#   counts:   strings, nodes, node documents, facts, relationships, aliases, mentioned names, mentions
+#   strings:  int64 offsets[strings + 1] + utf-8 blob, shared by node names, facts and relationship text
+#   nodes:    int32 name ids, int64 document offsets[nodes + 1] + int64 document ids
+#   facts:    int64 offsets[nodes + 1] + int64 document ids + int32 fact string ids
+#   edges:    int32 source, int32 target, int32 information string id, int64 document id, int8 backwards
+#   aliases:  int32 alias string ids, int32 kept entity string ids
+#   mentions: int32 name string ids, int64 document offsets[mentioned names + 1] + int64 document ids
+MAGIC = b"THSG"
+SNAPSHOT_VERSION = 4
+_HEADER = struct.Struct("<4sI32s")
+_COUNTS = struct.Struct("<8Q")
+
+def save_snapshot(graph: Dict[str, Node], path: str, fingerprint: bytes) -> None:
+    strings: Dict[str, int] = {}
+    def intern(text: str) -> int:
+        if text not in strings:
+            strings[text] = len(strings)
+        return strings[text]
+
+    node_ids = {name: i for i, name in enumerate(graph)}
+    node_names = array('i')
+    document_offsets = array('q', [0])
+    documents = array('q')
+    fact_offsets = array('q', [0])
+    fact_documents = array('q')
+    fact_texts = array('i')
+    rel_sources = array('i')
+    rel_targets = array('i')
+    rel_information = array('i')
+    rel_documents = array('q')
+    rel_backwards = array('b')
+    alias_names = array('i')
+    alias_targets = array('i')
+    mention_names = array('i')
+    mention_offsets = array('q', [0])
+    mention_documents = array('q')
+
+    for name, node in graph.items():
+        node_names.append(intern(name))
+        documents.extend(sorted(node.documents))
+        document_offsets.append(len(documents))
+        for doc_id, facts in node.facts.items():
+            for fact in facts:
+                fact_documents.append(doc_id)
+                fact_texts.append(intern(fact))
+        fact_offsets.append(len(fact_texts))
+        source = node_ids[name]
+        for target_node, relationships in node.edges.items():
+            target = node_ids[target_node.name]
+            for rel in relationships:
+                rel_sources.append(source)
+                rel_targets.append(target)
+                rel_information.append(intern(rel.information))
+                rel_documents.append(rel.document_source)
+                rel_backwards.append(1 if rel.backwards else 0)
+
+    for alias, name in getattr(graph, 'aliases', {}).items():
+        alias_names.append(intern(alias))
+        alias_targets.append(intern(name))
+
+    for name, doc_ids in getattr(graph, 'mentions', {}).items():
+        mention_names.append(intern(name))
+        mention_documents.extend(sorted(doc_ids))
+        mention_offsets.append(len(mention_documents))
+
+    string_offsets = array('q', [0])
+    blob = bytearray()
+    for text in strings:
+        blob += text.encode("utf-8")
+        string_offsets.append(len(blob))
+
+    sections = [string_offsets, bytes(blob), node_names, document_offsets, documents, fact_offsets, fact_documents,
+                fact_texts, rel_sources, rel_targets, rel_information, rel_documents, rel_backwards,
+                alias_names, alias_targets, mention_names, mention_offsets, mention_documents]
+
+    dir_path = os.path.dirname(path) or "."
+    os.makedirs(dir_path, exist_ok=True)
+    # Write next to the destination and rename, so a crash never leaves a truncated snapshot behind
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, SNAPSHOT_VERSION, fingerprint))
+            f.write(_COUNTS.pack(len(strings), len(node_names), len(documents), len(fact_texts), len(rel_sources),
+                                  len(alias_names), len(mention_names), len(mention_documents)))
+            for section in sections:
+                data = section.tobytes() if isinstance(section, array) else section
+                f.write(data)
+                f.write(b"\0" * (-len(data) % 8))
+        # mkstemp files are private; give the snapshot the mode open() would have
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def read_snapshot_fingerprint(path: str) -> Optional[bytes]:
+    # Returns the fingerprint stored in the snapshot, or None if it is missing or from another format version
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < _HEADER.size:
+        return None
+    magic, version, fingerprint = _HEADER.unpack(header)
+    if magic != MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    return fingerprint
+
+def is_snapshot_stale(path: str, fingerprint: bytes) -> bool:
+    return read_snapshot_fingerprint(path) != fingerprint
+
+class _Sections(NamedTuple):
+    strings: List[str]
+    node_names: array
+    document_offsets: array
+    documents: array
+    fact_offsets: array
+    fact_documents: array
+    fact_texts: array
+    rel_sources: array
+    rel_targets: array
+    rel_information: array
+    rel_documents: array
+    rel_backwards: array
+    alias_names: array
+    alias_targets: array
+    mention_names: array
+    mention_offsets: array
+    mention_documents: array
+
+def read_sections(path: str, fingerprint: Optional[bytes] = None) -> Optional[_Sections]:
+    # Reads every section of a snapshot. Returns None if there is no usable snapshot, or if a fingerprint
+    # is given and the snapshot was built from a different document set.
+    stored_fingerprint = read_snapshot_fingerprint(path)
+    if stored_fingerprint is None or (fingerprint is not None and stored_fingerprint != fingerprint):
+        return None
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offset = _HEADER.size
+        n_strings, n_nodes, n_documents, n_facts, n_rels, n_aliases, n_mentioned, n_mentions = _COUNTS.unpack_from(mm, offset)
+        offset += _COUNTS.size
+
+        def read_array(typecode: str, count: int) -> array:
+            nonlocal offset
+            values = array(typecode)
+            size = values.itemsize * count
+            values.frombytes(mm[offset:offset + size])
+            offset += size + (-size % 8)
+            return values
+
+        def read_bytes(size: int) -> bytes:
+            nonlocal offset
+            data = mm[offset:offset + size]
+            offset += size + (-size % 8)
+            return data
+
+        string_offsets = read_array('q', n_strings + 1)
+        blob = read_bytes(string_offsets[-1])
+        strings: List[str] = [blob[string_offsets[i]:string_offsets[i + 1]].decode("utf-8") for i in range(n_strings)]
+        return _Sections(strings, read_array('i', n_nodes), read_array('q', n_nodes + 1), read_array('q', n_documents),
+                         read_array('q', n_nodes + 1), read_array('q', n_facts), read_array('i', n_facts),
+                         read_array('i', n_rels), read_array('i', n_rels), read_array('i', n_rels), read_array('q', n_rels),
+                         read_array('b', n_rels), read_array('i', n_aliases), read_array('i', n_aliases),
+                         read_array('i', n_mentioned), read_array('q', n_mentioned + 1), read_array('q', n_mentions))
+
+def load_snapshot(path: str, fingerprint: Optional[bytes] = None) -> Optional[KnowledgeGraph]:
+    # Loads the graph from a snapshot. Returns None if there is no usable snapshot, or if a fingerprint
+    # is given and the snapshot was built from a different document set.
+    sections = read_sections(path, fingerprint)
+    if sections is None:
+        return None
+    (strings, node_names, document_offsets, documents, fact_offsets, fact_documents, fact_texts, rel_sources, rel_targets,
+     rel_information, rel_documents, rel_backwards, alias_names, alias_targets, mention_names, mention_offsets,
+     mention_documents) = sections
+
+    nodes = [Node(strings[name_id]) for name_id in node_names]
+    documents = documents.tolist()
+    fact_documents = fact_documents.tolist()
+    for i, node in enumerate(nodes):
+        node.documents = set(documents[document_offsets[i]:document_offsets[i + 1]])
+        node.document_mask = document_mask(node.documents)
+        facts = node.facts
+        for j in range(fact_offsets[i], fact_offsets[i + 1]):
+            doc_id = fact_documents[j]
+            if doc_id not in facts:
+                facts[doc_id] = set()
+            facts[doc_id].add(strings[fact_texts[j]])
+
+    # Relationships are stored grouped by source and target, so consecutive entries usually share an edge set
+    rel_sets = None
+    edge_masks = None
+    previous = (-1, -1)
+    for source, target, information, doc_id, backwards in zip(rel_sources.tolist(), rel_targets.tolist(), rel_information.tolist(),
+                                                            rel_documents.tolist(), rel_backwards.tolist()):
+        if (source, target) != previous:
+            previous = (source, target)
+            edges = nodes[source].edges
+            edge_masks = nodes[source].edge_masks
+            target_node = nodes[target]
+            rel_sets = edges.get(target_node)
+            if rel_sets is None:
+                rel_sets = edges[target_node] = set()
+                edge_masks[target_node] = 0
+        rel_sets.add(Relationship(strings[information], doc_id, backwards == 1))
+        edge_masks[target_node] |= 1 << doc_id
+
+    graph = KnowledgeGraph()
+    graph.update((node.name, node) for node in nodes)
+    graph.aliases = {strings[alias]: strings[name] for alias, name in zip(alias_names, alias_targets)}
+    mention_documents = mention_documents.tolist()
+    graph.mentions = {strings[name_id]: set(mention_documents[mention_offsets[i]:mention_offsets[i + 1]])
+                      for i, name_id in enumerate(mention_names)}
+    graph.rebuild_document_index()
+    return graph
+
+def load_compact_snapshot(path: str, fingerprint: Optional[bytes] = None) -> Optional[CompactGraph]:
+    # Loads a snapshot straight into a CompactGraph, without building a Node per entity and a set per edge
+    # first, so the full object graph never has to fit in memory. Returns None like load_snapshot.
+    sections = read_sections(path, fingerprint)
+    if sections is None:
+        return None
+    compact = CompactGraph()
+    strings = compact.strings = sections.strings
+    compact.names = [strings[name_id] for name_id in sections.node_names]
+    compact.ids = {name: i for i, name in enumerate(compact.names)}
+    # Documents are stored sorted per node and facts already point into the shared string table
+    compact.document_offsets = sections.document_offsets
+    compact.document_ids = sections.documents
+    compact.fact_offsets = sections.fact_offsets
+    compact.fact_documents = sections.fact_documents
+    compact.fact_texts = sections.fact_texts
+    documents = sections.documents.tolist()
+    compact.node_masks = [document_mask(documents[sections.document_offsets[i]:sections.document_offsets[i + 1]])
+                          for i in range(len(compact.names))]
+
+    rel_ids: Dict[tuple, int] = {}
+    def intern_relationship(information: int, doc_id: int) -> int:
+        key = (information, doc_id)
+        if key not in rel_ids:
+            rel_ids[key] = len(compact.rel_information)
+            compact.rel_information.append(information)
+            compact.rel_documents.append(doc_id)
+        return rel_ids[key]
+
+    # Relationships are saved node by node, so one source's relationships are consecutive; each row is
+    # gathered per target and then written out with the targets sorted by id
+    row: Dict[int, List[int]] = {}
+    row_masks: Dict[int, int] = {}
+    def flush_row() -> None:
+        for target in sorted(row):
+            compact.adjacency_targets.append(target)
+            compact.adjacency_rels.extend(row[target])
+            compact.adjacency_rel_offsets.append(len(compact.adjacency_rels))
+            compact.adjacency_masks.append(row_masks[target])
+        compact.adjacency_offsets.append(len(compact.adjacency_targets))
+        row.clear()
+        row_masks.clear()
+
+    source_id = 0
+    for source, target, information, doc_id, backwards in zip(sections.rel_sources, sections.rel_targets, sections.rel_information,
+                                                            sections.rel_documents, sections.rel_backwards):
+        while source_id < source:
+            flush_row()
+            source_id += 1
+        row.setdefault(target, []).append(intern_relationship(information, doc_id) << 1 | backwards)
+        row_masks[target] = row_masks.get(target, 0) | 1 << doc_id
+    while source_id < len(compact.names):
+        flush_row()
+        source_id += 1
+
+    compact.aliases = {strings[alias]: strings[name] for alias, name in zip(sections.alias_names, sections.alias_targets)}
+    return compact
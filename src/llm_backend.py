@@ -0,0 +1,159 @@
+import os
+import random
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, Iterable, List, Optional, Protocol, Tuple, Type, TypeVar, Union, get_args, get_origin
+from pydantic import BaseModel
+from rate_limiter import estimate_tokens
+from tracing import annotate
+
+T = TypeVar("T", bound=BaseModel)
+
+class LLMBackend(Protocol):
+    # Anything that can answer a structured-output chat request. `name` keeps cached responses from
+    # different backends apart, and `retryable_errors` are the failures worth retrying with backoff.
+    name: str
+    retryable_errors: Tuple[Type[BaseException], ...]
+
+    def parse(self, model: str, messages: List[dict], response_format: Type[T]) -> T:
+        ...
+
+class OpenAIBackend:
+    # The OpenAI API. The SDK is imported and the client created on the first request, so importing the
+    # graph or search code needs neither the network nor an API key.
+    name = "openai"
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from dotenv import load_dotenv
+                from openai import OpenAI
+                load_dotenv()
+                self._client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            return self._client
+
+    @property
+    def retryable_errors(self) -> Tuple[Type[BaseException], ...]:
+        # The request itself was fine, the API just couldn't serve it right now
+        import openai
+        return (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+    def parse(self, model: str, messages: List[dict], response_format: Type[T]) -> T:
+        completion = self.client.beta.chat.completions.parse(model=model, messages=messages, response_format=response_format)
+        if completion.usage is not None:
+            annotate(prompt_tokens=completion.usage.prompt_tokens, completion_tokens=completion.usage.completion_tokens)
+        return completion.choices[0].message.parsed
+
+# A responder gets the messages and the expected response type, and returns an instance of it (or a dict of its
+# fields), or None to fall back to the default response
+Responder = Callable[[List[dict], Type[BaseModel]], Optional[Union[BaseModel, dict]]]
+
+class LocalBackend:
+    # Offline stand-in for measuring throughput and concurrency without a network. Each request sleeps for
+    # `latency` seconds (plus up to `jitter` more), then answers with the next scripted response, what
+    # `responder` returns, or the default response for the schema: first enum member, False, 0, "" and [].
+    name = "local"
+    retryable_errors: Tuple[Type[BaseException], ...] = ()
+
+    def __init__(self, responses: Optional[Iterable[Union[BaseModel, dict]]] = None, responder: Optional[Responder] = None,
+                 latency: float = 0.0, jitter: float = 0.0, seed: Optional[int] = None):
+        self.responses = iter(responses) if responses is not None else None
+        self.responder = responder
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def parse(self, model: str, messages: List[dict], response_format: Type[T]) -> T:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            scripted = next(self.responses, None) if self.responses is not None else None
+        try:
+            if delay:
+                time.sleep(delay)
+            response = scripted
+            if response is None and self.responder is not None:
+                response = self.responder(messages, response_format)
+            if response is None:
+                response = default_response(response_format)
+            elif not isinstance(response, response_format):
+                response = response_format.model_validate(response)
+            # Estimated the same way the rate limiter budgets requests
+            annotate(prompt_tokens=sum(estimate_tokens(message["content"]) for message in messages),
+                     completion_tokens=estimate_tokens(response.model_dump_json()))
+            return response
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+class LimitedBackend:
+    # Wraps a backend so at most max_concurrent requests are in flight at once, however many threads (batch
+    # searches, extraction workers, server requests) share it: set_backend(LimitedBackend(get_backend(), 16))
+    def __init__(self, backend: LLMBackend, max_concurrent: int):
+        self.backend = backend
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    @property
+    def retryable_errors(self) -> Tuple[Type[BaseException], ...]:
+        return self.backend.retryable_errors
+
+    def parse(self, model: str, messages: List[dict], response_format: Type[T]) -> T:
+        with self._slots:
+            return self.backend.parse(model, messages, response_format)
+
+def default_value(annotation: Any) -> Any:
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        return next(iter(annotation))
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return default_response(annotation)
+    if get_origin(annotation) is list:
+        return []
+    if get_origin(annotation) is Union:
+        return default_value(get_args(annotation)[0])
+    if annotation is bool:
+        return False
+    if annotation in (int, float):
+        return annotation()
+    return ""
+
+def default_response(response_format: Type[T]) -> T:
+    return response_format(**{name: default_value(field.annotation) for name, field in response_format.model_fields.items()})
+
+_backend: Optional[LLMBackend] = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> LLMBackend:
+    # The backend every LLM call goes through, created on first use. LLM_BACKEND=local runs everything offline.
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = LocalBackend() if os.getenv("LLM_BACKEND") == "local" else OpenAIBackend()
+        return _backend
+
+def set_backend(backend: Optional[LLMBackend]) -> None:
+    # Swaps the backend (None goes back to the default on next use)
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+def cache_model(model: str) -> str:
+    # The model name cache keys use: responses from another backend must never be served as the real model's
+    backend = get_backend()
+    return model if backend.name == OpenAIBackend.name else f"{backend.name}:{model}"
@@ -1,7 +1,7 @@
 from model.node import Node
 from model.relationship import Relationship
 from typing import Set, Dict
-from graph_creator import create_knowledge_graph
+from graph_creator import create_knowledge_graph, read_documents
 from visualization_tool import visualize
 from search import search
 import os
@@ -13,23 +13,11 @@ def main():
     # Read and process documents
     documents = read_documents()
 
-    graph = create_knowledge_graph(documents)
+    graph = create_knowledge_graph(documents, snapshot_path="src/graph_info/graph.snapshot")
 
    # search(graph, "Who is Sue's favorite customer? Include their name.", 3)
     visualize(graph)
 
 
-def read_documents() -> Dict[int, str]:
-    documents = {}
-    document_id = 0
-    documents_dir = "documents"
-    for filename in os.listdir(documents_dir):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(documents_dir, filename)
-            with open(file_path, 'r') as file:
-                documents[document_id] = file.read()
-            document_id += 1
-    return documents
-
 if __name__ == "__main__":
     main()
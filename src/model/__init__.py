@@ -1,7 +1,15 @@
 from .node import Node
 from .relationship import Relationship
+from .graph import KnowledgeGraph
+from .compact_graph import CompactGraph, CompactNode
+from .graph_view import GraphView, permitted_view
 
 __all__ = [
     'Node', 
-    'Relationship'
+    'Relationship',
+    'KnowledgeGraph',
+    'CompactGraph',
+    'CompactNode',
+    'GraphView',
+    'permitted_view'
     ]
@@ -0,0 +1,240 @@
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterator, List, Mapping, Set, Tuple
+from .node import Node
+from .relationship import Relationship
+from .permissions import Permissions, compile_permissions
+from .graph_view import ViewCache
+
+class CompactGraph(Mapping[str, 'CompactNode']):
+    # Read-only graph stored in flat arrays instead of per-node dicts and sets:
+    # - node names are interned to integer ids
+    # - documents, facts and adjacency are CSR style (one offsets array per node plus a flat values array)
+    # - fact and relationship text live once in a shared string table
+    # - each distinct (information, document) relationship is stored once; adjacency entries point at it
+    #   with the backwards flag packed into the low bit, instead of a Relationship object per direction
+    # Nodes and relationship sets are materialized on access, so search, Path and the visualizer can use
+    # it exactly like a Dict[str, Node].
+    def __init__(self):
+        self.version = 0
+        self.names: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+        self.document_offsets = array('q', [0])
+        self.document_ids = array('q')
+        self.fact_offsets = array('q', [0])
+        self.fact_documents = array('q')
+        self.fact_texts = array('i')
+        self.adjacency_offsets = array('q', [0])
+        self.adjacency_targets = array('i')
+        self.adjacency_rel_offsets = array('q', [0])
+        self.adjacency_rels = array('i')
+        self.rel_information = array('i')
+        self.rel_documents = array('q')
+        # Document bitmasks per node and per adjacency entry (arbitrary-size ints, so kept in lists)
+        self.node_masks: List[int] = []
+        self.adjacency_masks: List[int] = []
+        self.aliases: Dict[str, str] = {}
+        self.views = ViewCache()
+        # Slots for model.graph.derived_data
+        self.derived: Dict[str, Tuple[int, Any]] = {}
+
+    @classmethod
+    def from_graph(cls, graph: Mapping[str, Node]) -> 'CompactGraph':
+        compact = cls()
+        compact.version = getattr(graph, 'version', 0)
+        compact.aliases = dict(getattr(graph, 'aliases', {}))
+        string_ids: Dict[str, int] = {}
+        rel_ids: Dict[Tuple[int, int], int] = {}
+
+        def intern(text: str) -> int:
+            if text not in string_ids:
+                string_ids[text] = len(compact.strings)
+                compact.strings.append(text)
+            return string_ids[text]
+
+        def intern_relationship(rel: Relationship) -> int:
+            key = (intern(rel.information), rel.document_source)
+            if key not in rel_ids:
+                rel_ids[key] = len(compact.rel_information)
+                compact.rel_information.append(key[0])
+                compact.rel_documents.append(key[1])
+            return rel_ids[key]
+
+        for name in graph:
+            compact.ids[name] = len(compact.names)
+            compact.names.append(name)
+
+        for name, node in graph.items():
+            compact.document_ids.extend(sorted(node.documents))
+            compact.node_masks.append(node.document_mask)
+            compact.document_offsets.append(len(compact.document_ids))
+            for doc_id, facts in node.facts.items():
+                for fact in facts:
+                    compact.fact_documents.append(doc_id)
+                    compact.fact_texts.append(intern(fact))
+            compact.fact_offsets.append(len(compact.fact_texts))
+            # Targets are sorted by id so an edge lookup is a binary search within the node's row
+            targets = sorted(((compact.ids[target.name], target) for target in node.edges), key=lambda item: item[0])
+            for target_id, target in targets:
+                compact.adjacency_targets.append(target_id)
+                compact.adjacency_rels.extend(intern_relationship(rel) << 1 | rel.backwards for rel in node.edges[target])
+                compact.adjacency_rel_offsets.append(len(compact.adjacency_rels))
+                compact.adjacency_masks.append(node.edge_mask(target))
+            compact.adjacency_offsets.append(len(compact.adjacency_targets))
+
+        return compact
+
+    def restricted(self, permission_mask: int) -> 'CompactGraph':
+        # The part of the graph visible under one permission mask, kept compact: the counterpart of GraphView,
+        # dropping nodes, documents, facts, edges and relationships from documents the mask doesn't include.
+        # The string and relationship tables are shared with this graph rather than copied.
+        view = CompactGraph()
+        view.version = self.version
+        view.aliases = self.aliases
+        view.permission_mask = permission_mask
+        view.strings = self.strings
+        view.rel_information = self.rel_information
+        view.rel_documents = self.rel_documents
+        rel_documents = self.rel_documents
+
+        # Kept nodes stay in the same order, so sorted adjacency rows stay sorted under the new ids
+        new_ids: Dict[int, int] = {}
+        for node_id, name in enumerate(self.names):
+            if self.node_masks[node_id] & permission_mask:
+                new_ids[node_id] = len(view.names)
+                view.ids[name] = len(view.names)
+                view.names.append(name)
+
+        for node_id in new_ids:
+            view.document_ids.extend(doc_id for doc_id in self.document_ids[self.document_offsets[node_id]:self.document_offsets[node_id + 1]]
+                                     if 1 << doc_id & permission_mask)
+            view.document_offsets.append(len(view.document_ids))
+            view.node_masks.append(self.node_masks[node_id] & permission_mask)
+            for i in range(self.fact_offsets[node_id], self.fact_offsets[node_id + 1]):
+                if 1 << self.fact_documents[i] & permission_mask:
+                    view.fact_documents.append(self.fact_documents[i])
+                    view.fact_texts.append(self.fact_texts[i])
+            view.fact_offsets.append(len(view.fact_texts))
+            for i in range(self.adjacency_offsets[node_id], self.adjacency_offsets[node_id + 1]):
+                target = new_ids.get(self.adjacency_targets[i])
+                if target is None or not self.adjacency_masks[i] & permission_mask:
+                    continue
+                rels = [packed for packed in self.adjacency_rels[self.adjacency_rel_offsets[i]:self.adjacency_rel_offsets[i + 1]]
+                        if 1 << rel_documents[packed >> 1] & permission_mask]
+                view.adjacency_targets.append(target)
+                view.adjacency_rels.extend(rels)
+                view.adjacency_rel_offsets.append(len(view.adjacency_rels))
+                view.adjacency_masks.append(self.adjacency_masks[i] & permission_mask)
+            view.adjacency_offsets.append(len(view.adjacency_targets))
+        return view
+
+    def node(self, node_id: int) -> 'CompactNode':
+        return CompactNode(self, node_id)
+
+    def relationships(self, adjacency_index: int) -> Set[Relationship]:
+        start, end = self.adjacency_rel_offsets[adjacency_index], self.adjacency_rel_offsets[adjacency_index + 1]
+        result = set()
+        for packed in self.adjacency_rels[start:end]:
+            rel_id = packed >> 1
+            result.add(Relationship(self.strings[self.rel_information[rel_id]], self.rel_documents[rel_id], bool(packed & 1)))
+        return result
+
+    def __getitem__(self, name: str) -> 'CompactNode':
+        return CompactNode(self, self.ids[name])
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+class CompactNode:
+    # Lightweight handle onto one node of a CompactGraph, exposing the same attributes as Node
+    __slots__ = ('graph', 'id')
+
+    def __init__(self, graph: CompactGraph, node_id: int):
+        self.graph = graph
+        self.id = node_id
+
+    @property
+    def name(self) -> str:
+        return self.graph.names[self.id]
+
+    @property
+    def documents(self) -> Set[int]:
+        graph = self.graph
+        return set(graph.document_ids[graph.document_offsets[self.id]:graph.document_offsets[self.id + 1]])
+
+    @property
+    def facts(self) -> Dict[int, Set[str]]:
+        graph = self.graph
+        facts: Dict[int, Set[str]] = {}
+        for i in range(graph.fact_offsets[self.id], graph.fact_offsets[self.id + 1]):
+            facts.setdefault(graph.fact_documents[i], set()).add(graph.strings[graph.fact_texts[i]])
+        return facts
+
+    @property
+    def edges(self) -> 'CompactEdges':
+        return CompactEdges(self)
+
+    @property
+    def document_mask(self) -> int:
+        return self.graph.node_masks[self.id]
+
+    def edge_mask(self, target_node: 'CompactNode') -> int:
+        i = CompactEdges(self)._index(target_node)
+        return self.graph.adjacency_masks[i] if i >= 0 else 0
+
+    def get_edge_weight(self, target_node: 'CompactNode', permissions: Permissions) -> int:
+        # Returns the number of relationships in the edge to target_node that can be accessed based on permissions
+        permission_mask = compile_permissions(permissions)
+        return sum(1 for relationship in self.edges[target_node] if 1 << relationship.document_source & permission_mask)
+
+    def __hash__(self) -> int:
+        return self.id
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CompactNode):
+            return NotImplemented
+        return self.id == other.id and self.graph is other.graph
+
+    def __repr__(self) -> str:
+        return f"CompactNode(name='{self.name}')"
+
+class CompactEdges(Mapping[CompactNode, Set[Relationship]]):
+    # Mapping of neighbor -> relationships for one node, read straight from the adjacency arrays
+    __slots__ = ('node', 'start', 'end')
+
+    def __init__(self, node: CompactNode):
+        self.node = node
+        self.start = node.graph.adjacency_offsets[node.id]
+        self.end = node.graph.adjacency_offsets[node.id + 1]
+
+    def _index(self, target: object) -> int:
+        if isinstance(target, CompactNode) and target.graph is self.node.graph:
+            targets = self.node.graph.adjacency_targets
+            i = bisect_left(targets, target.id, self.start, self.end)
+            if i < self.end and targets[i] == target.id:
+                return i
+        return -1
+
+    def __getitem__(self, target: CompactNode) -> Set[Relationship]:
+        i = self._index(target)
+        if i < 0:
+            raise KeyError(target)
+        return self.node.graph.relationships(i)
+
+    def __contains__(self, target: object) -> bool:
+        return self._index(target) >= 0
+
+    def __iter__(self) -> Iterator[CompactNode]:
+        graph = self.node.graph
+        for i in range(self.start, self.end):
+            yield CompactNode(graph, graph.adjacency_targets[i])
+
+    def __len__(self) -> int:
+        return self.end - self.start
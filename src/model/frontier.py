@@ -0,0 +1,37 @@
+from typing import Dict, List, Mapping, Set, Tuple
+from .node import Node
+from .path import Path
+
+class Frontier:
+    # The options a best first search can take next: an explored path extended by one edge to a node
+    # that hasn't been visited yet. Options are kept between steps, so expanding a node only adds that
+    # node's own neighbors and removes the options that led to it, instead of re-enumerating every path.
+    def __init__(self, graph: Mapping[str, Node], permission_mask: int):
+        self.graph = graph
+        self.permission_mask = permission_mask
+        # (from node name, to node name) -> option path, in the order options were discovered
+        self.options: Dict[Tuple[str, str], Path] = {}
+        self.by_target: Dict[str, Set[Tuple[str, str]]] = {}
+
+    def expand(self, path: Path, visited: Set[Node]) -> None:
+        # Adds an option for every permitted, unvisited neighbor of the path's last node
+        node = path.last_node()
+        for neighbor in node.edges.keys():
+            if neighbor not in visited and node.edge_mask(neighbor) & self.permission_mask:
+                key = (node.name, neighbor.name)
+                if key in self.options:
+                    continue
+                # O(1): the option shares the explored path instead of copying it
+                self.options[key] = path.extend(node.edges[neighbor], self.graph[neighbor.name])
+                self.by_target.setdefault(neighbor.name, set()).add(key)
+
+    def visit(self, node: Node) -> None:
+        # Drops every option that leads to a node that has now been explored
+        for key in self.by_target.pop(node.name, set()):
+            del self.options[key]
+
+    def to_list(self) -> List[Path]:
+        return list(self.options.values())
+
+    def __len__(self) -> int:
+        return len(self.options)
@@ -0,0 +1,244 @@
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set, Tuple, TypeVar
+from .node import Node
+from .relationship import Relationship
+from .graph_view import ViewCache
+from .names import resolution_key
+
+T = TypeVar("T")
+
+def resolve_alias(aliases: Dict[str, str], name: str) -> str:
+    # Follows merges to the entity that was finally kept (a kept entity may itself be merged later)
+    while name in aliases:
+        name = aliases[name]
+    return name
+
+def derived_data(graph: Mapping[str, Node], name: str, build: Callable[[Optional[T]], T]) -> T:
+    # Data computed from a graph, kept in the graph's `derived` slots until its version changes. build is given
+    # the value from an earlier version (or None), for data that can be updated rather than rebuilt. Plain
+    # mappings have no version to tell when they change, so their data is built on every call.
+    derived = getattr(graph, 'derived', None)
+    if derived is None:
+        return build(None)
+    version = graph.version
+    cached = derived.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    value = build(cached[1] if cached is not None else None)
+    derived[name] = (version, value)
+    return value
+
+def graph_differences(expected: Mapping[str, Node], actual: Mapping[str, Node], limit: int = 10) -> List[str]:
+    # What tells two graphs apart (entities, their documents, facts and edges, and aliases), at most `limit`
+    # things. Used to check that updating documents one at a time ends where a full build does.
+    differences = []
+    for name in expected.keys() - actual.keys():
+        differences.append(f"missing entity {name!r}")
+    for name in actual.keys() - expected.keys():
+        differences.append(f"unexpected entity {name!r}")
+    for name in expected.keys() & actual.keys():
+        expected_node, actual_node = expected[name], actual[name]
+        if expected_node.documents != actual_node.documents:
+            differences.append(f"{name!r} documents {sorted(expected_node.documents)} != {sorted(actual_node.documents)}")
+        if expected_node.facts != actual_node.facts:
+            differences.append(f"{name!r} facts {expected_node.facts} != {actual_node.facts}")
+        expected_edges = {target.name: relationships for target, relationships in expected_node.edges.items()}
+        actual_edges = {target.name: relationships for target, relationships in actual_node.edges.items()}
+        if expected_edges != actual_edges:
+            differences.append(f"{name!r} edges {expected_edges} != {actual_edges}")
+    expected_aliases, actual_aliases = getattr(expected, 'aliases', {}), getattr(actual, 'aliases', {})
+    if expected_aliases != actual_aliases:
+        differences.append(f"aliases {expected_aliases} != {actual_aliases}")
+    return differences[:limit]
+
+class KnowledgeGraph(Dict[str, Node]):
+    # The graph is still a plain mapping of entity name to Node, but it also remembers which nodes every
+    # document contributed to, so a document can be retracted without scanning the whole graph.
+    # version increases on every change, so derived data can tell when it is out of date.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+        self.document_nodes: Dict[int, Set[str]] = {}
+        # Names merged into another entity, so later mentions land on the kept node, and the other way round
+        # (kept name to every name merged into it)
+        self.aliases: Dict[str, str] = {}
+        self.merged_names: Dict[str, Set[str]] = {}
+        # Names as documents wrote them, before aliases were applied. Once no document uses a name it stops
+        # being an alias, and a node is always named after the name resolution would keep from the current
+        # mentions, so updating documents one at a time ends with the graph a full build would give
+        self.mentions: Dict[str, Set[int]] = {}
+        self.document_mentions: Dict[int, Set[str]] = {}
+        # Live entity names by resolution key, and keys by word, so resolving the names an update touched only
+        # looks at their keys (and, for subset merges, the keys sharing their words)
+        self.names_by_key: Dict[str, Set[str]] = {}
+        self.keys_by_word: Dict[str, Set[str]] = {}
+        self.views = ViewCache()
+        # derived_data slots, each (version, value): "entity_index", "render_cache", "networkx_graph" and "layout"
+        self.derived: Dict[str, Tuple[int, Any]] = {}
+        self.rebuild_document_index()
+
+    def add_node(self, name: str, facts: List[str], doc_id: int) -> Node:
+        self.mentions.setdefault(name, set()).add(doc_id)
+        self.document_mentions.setdefault(doc_id, set()).add(name)
+        name = resolve_alias(self.aliases, name)
+        if name not in self:
+            self[name] = Node(name)
+            self._index_name(name)
+        node = self[name]
+        node.add_document(doc_id)
+        for fact in facts:
+            node.add_fact(doc_id, fact)
+        self.document_nodes.setdefault(doc_id, set()).add(name)
+        self.version += 1
+        return node
+
+    def add_relationship(self, source: str, target: str, information: str, doc_id: int) -> None:
+        # Every relationship is stored on both nodes, the copy on the target marked as backwards
+        source_node = self.add_node(source, [], doc_id)
+        target_node = self.add_node(target, [], doc_id)
+        source_node.add_relationship(target_node, Relationship(information, doc_id, False))
+        target_node.add_relationship(source_node, Relationship(information, doc_id, True))
+
+    def merge_nodes(self, keep: str, drop: str) -> None:
+        # Folds drop's documents, facts and edges into keep and removes drop, remembering it as an alias
+        keep_node, drop_node = self[keep], self[drop]
+        for doc_id in drop_node.documents:
+            keep_node.add_document(doc_id)
+            names = self.document_nodes.setdefault(doc_id, set())
+            names.discard(drop)
+            names.add(keep)
+        for doc_id, facts in drop_node.facts.items():
+            for fact in facts:
+                keep_node.add_fact(doc_id, fact)
+        for target_node, relationships in drop_node.edges.items():
+            # An edge between the two merged entities becomes a self loop on the kept one
+            new_target = keep_node if target_node is drop_node else target_node
+            for rel in relationships:
+                keep_node.add_relationship(new_target, rel)
+            if target_node is not drop_node:
+                target_node.edge_masks.pop(drop_node)
+                for rel in target_node.edges.pop(drop_node):
+                    target_node.add_relationship(keep_node, rel)
+        del self[drop]
+        self._unindex_name(drop)
+
+        # Aliases always point straight at a live node
+        moved = self.merged_names.pop(drop, set())
+        moved.add(drop)
+        for name in moved:
+            self.aliases[name] = keep
+        self.merged_names.setdefault(keep, set()).update(moved)
+        self.version += 1
+
+    def rename_node(self, name: str, new_name: str) -> None:
+        # Moves a node to another name it is known by; the old name becomes an alias if documents still use it
+        self[new_name] = Node(new_name)
+        self._index_name(new_name)
+        self.merge_nodes(new_name, name)
+        del self.aliases[new_name]
+        self.merged_names[new_name].discard(new_name)
+        if name not in self.mentions:
+            del self.aliases[name]
+            self.merged_names[new_name].discard(name)
+        if not self.merged_names[new_name]:
+            del self.merged_names[new_name]
+
+    def name_rank(self, name: str) -> Tuple[int, int, int, str]:
+        # Which of an entity's names it is kept under (lowest first): the most specific, then the one most
+        # documents use, then the one used earliest
+        doc_ids = self.mentions.get(name, ())
+        return -len(resolution_key(name).split()), -len(doc_ids), min(doc_ids, default=-1), name
+
+    def preferred_name(self, name: str) -> str:
+        # The name a live node should be kept under, out of its own and every name merged into it that documents use
+        names = [other for other in self.merged_names.get(name, set()) | {name} if other in self.mentions]
+        return min(names, key=self.name_rank) if names else name
+
+    def remove_document(self, doc_id: int) -> None:
+        # Retracts everything the document contributed and drops nodes that are left with nothing
+        names = self.document_nodes.pop(doc_id, set())
+        for name in names:
+            if name in self:
+                self[name].remove_document(doc_id)
+        for name in names:
+            if name in self and self[name].is_empty():
+                del self[name]
+                self._unindex_name(name)
+        retracted = set()
+        for name in self.document_mentions.pop(doc_id, set()):
+            doc_ids = self.mentions[name]
+            doc_ids.discard(doc_id)
+            if not doc_ids:
+                del self.mentions[name]
+                retracted.add(name)
+        self.retract_names(retracted)
+        for name in names:
+            if name in self:
+                preferred = self.preferred_name(name)
+                if preferred != name:
+                    self.rename_node(name, preferred)
+            else:
+                self.merged_names.pop(name, None)
+        self.version += 1
+
+    def _index_name(self, name: str) -> None:
+        key = resolution_key(name)
+        if not key:
+            return
+        if key not in self.names_by_key:
+            self.names_by_key[key] = set()
+            for word in key.split():
+                self.keys_by_word.setdefault(word, set()).add(key)
+        self.names_by_key[key].add(name)
+
+    def _unindex_name(self, name: str) -> None:
+        key = resolution_key(name)
+        names = self.names_by_key.get(key)
+        if names is None:
+            return
+        names.discard(name)
+        if not names:
+            del self.names_by_key[key]
+            for word in key.split():
+                keys = self.keys_by_word[word]
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_word[word]
+
+    def retract_names(self, names: Set[str]) -> None:
+        # Forgets aliases no document uses any more
+        for name in names:
+            if name in self.aliases:
+                target = self.aliases.pop(name)
+                merged = self.merged_names.get(target)
+                if merged is not None:
+                    merged.discard(name)
+                    if not merged:
+                        del self.merged_names[target]
+
+    def rebuild_document_index(self) -> None:
+        self.document_nodes = {}
+        self.names_by_key = {}
+        self.keys_by_word = {}
+        for name, node in self.items():
+            self._index_name(name)
+            doc_ids = set(node.documents)
+            doc_ids.update(node.facts.keys())
+            for relationships in node.edges.values():
+                doc_ids.update(rel.document_source for rel in relationships)
+            for doc_id in doc_ids:
+                self.document_nodes.setdefault(doc_id, set()).add(name)
+        self.aliases = {alias: resolve_alias(self.aliases, alias) for alias in self.aliases}
+        self.merged_names = {}
+        for alias, name in self.aliases.items():
+            self.merged_names.setdefault(name, set()).add(alias)
+        # A graph that wasn't built through add_node has no mentions yet, so every node counts as mentioned
+        # by its own name in all of its documents
+        if not self.mentions:
+            for doc_id, names in self.document_nodes.items():
+                for name in names:
+                    self.mentions.setdefault(name, set()).add(doc_id)
+        self.document_mentions = {}
+        for name, doc_ids in self.mentions.items():
+            for doc_id in doc_ids:
+                self.document_mentions.setdefault(doc_id, set()).add(name)
+        self.version += 1
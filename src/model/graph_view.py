@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Tuple
+from .node import Node
+from .permissions import ALL_DOCUMENTS, Permissions, compile_permissions
+
+class GraphView(Dict[str, Node]):
+    # Read-only copy of the part of a graph visible under one permission mask: only permitted nodes,
+    # facts, documents and relationships are kept, so code running over a view never has to filter.
+    # Treat it as immutable; it is shared by everyone with the same permissions.
+    def __init__(self, graph: Mapping[str, Node], permission_mask: int):
+        super().__init__()
+        self.permission_mask = permission_mask
+        self.version = getattr(graph, 'version', 0)
+        self.aliases = getattr(graph, 'aliases', {})
+        # Slots for model.graph.derived_data
+        self.derived: Dict[str, Tuple[int, Any]] = {}
+
+        for name, node in graph.items():
+            if not node.document_mask & permission_mask:
+                continue
+            view_node = Node(name)
+            view_node.documents = {doc_id for doc_id in node.documents if 1 << doc_id & permission_mask}
+            view_node.document_mask = node.document_mask & permission_mask
+            view_node.facts = {doc_id: set(facts) for doc_id, facts in node.facts.items() if 1 << doc_id & permission_mask}
+            self[name] = view_node
+
+        for name, view_node in self.items():
+            node = graph[name]
+            for target_node in node.edges:
+                if node.edge_mask(target_node) & permission_mask and target_node.name in self:
+                    for rel in node.edges[target_node]:
+                        if rel.document_mask() & permission_mask:
+                            view_node.add_relationship(self[target_node.name], rel)
+
+class ViewCache:
+    # LRU cache of views keyed by (graph version, permission mask), safe to share between threads
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.views: 'OrderedDict[Tuple[int, int], GraphView]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, graph: Mapping[str, Node], permission_mask: int) -> GraphView:
+        key = (getattr(graph, 'version', 0), permission_mask)
+        with self._lock:
+            view = self.views.get(key)
+            if view is not None:
+                self.views.move_to_end(key)
+                self.hits += 1
+                return view
+            self.misses += 1
+
+        # Build outside the lock so other permission sets aren't blocked while this one is filtered
+        view = build_view(graph, permission_mask)
+        with self._lock:
+            # Views of older graph versions can never be hit again
+            for stale_key in [k for k in self.views if k[0] != key[0]]:
+                del self.views[stale_key]
+            self.views[key] = view
+            self.views.move_to_end(key)
+            while len(self.views) > self.maxsize:
+                self.views.popitem(last=False)
+        return view
+
+    def clear(self) -> None:
+        with self._lock:
+            self.views.clear()
+
+def build_view(graph: Mapping[str, Node], permission_mask: int) -> Mapping[str, Node]:
+    # Graphs that can filter themselves (CompactGraph.restricted) keep their own representation
+    restricted = getattr(graph, 'restricted', None)
+    return restricted(permission_mask) if restricted is not None else GraphView(graph, permission_mask)
+
+def permitted_view(graph: Mapping[str, Node], permissions: Permissions) -> Mapping[str, Node]:
+    # Returns the graph as seen with the given permissions, cached on the graph when it has a view cache
+    permission_mask = compile_permissions(permissions)
+    if permission_mask == ALL_DOCUMENTS:
+        # Nothing to filter with global access
+        return graph
+    cache = getattr(graph, 'views', None)
+    if cache is None:
+        return build_view(graph, permission_mask)
+    return cache.get(graph, permission_mask)
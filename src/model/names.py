@@ -0,0 +1,19 @@
+import re
+
+# How entity names are compared: shared by the graph's indexes, entity lookup and entity resolution
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+_ARTICLES = {"the", "a", "an"}
+
+def normalize(name: str) -> str:
+    # Case, punctuation, possessives and extra whitespace don't distinguish entities
+    name = re.sub(r"['’]s\b", "", name.lower())
+    return " ".join(_TOKEN_PATTERN.findall(name))
+
+def resolution_key(name: str) -> str:
+    # Names with the same key are the same entity ("The Acme Corp.", "acme corp" and "Corp, Acme")
+    words = normalize(name).split()
+    while len(words) > 1 and words[0] in _ARTICLES:
+        words = words[1:]
+    return " ".join(sorted(set(words)))
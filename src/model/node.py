@@ -1,6 +1,7 @@
 from dataclasses import dataclass, field
 from typing import Set, Dict, Any
 from .relationship import Relationship
+from .permissions import Permissions, compile_permissions
 
 @dataclass
 class Node:
@@ -8,15 +9,21 @@ class Node:
     facts: Dict[int, Set[str]] = field(default_factory=dict)
     documents: Set[int] = field(default_factory=set)
     edges: Dict['Node', Set[Relationship]] = field(default_factory=dict)
+    # Bitmasks of the documents behind the node and behind each edge, see model.permissions
+    document_mask: int = 0
+    edge_masks: Dict['Node', int] = field(default_factory=dict)
 
     def __init__(self, name: str):
         self.name = name
         self.facts = dict()
         self.documents = set()
         self.edges = dict()
+        self.document_mask = 0
+        self.edge_masks = dict()
 
     def add_document(self, document: int) -> None:
         self.documents.add(document)
+        self.document_mask |= 1 << document
 
     def add_fact(self, document: int, fact: str) -> None:
         if document not in self.facts:
@@ -27,10 +34,34 @@ class Node:
         if target_node not in self.edges:
             self.edges[target_node] = set()
         self.edges[target_node].add(relationship)
+        self.edge_masks[target_node] = self.edge_masks.get(target_node, 0) | 1 << relationship.document_source
 
-    def get_edge_weight(self, target_node: 'Node', permissions: Set[str]) -> int:
+    def remove_document(self, document: int) -> None:
+        # Removes the document's facts and relationships, dropping edges that no longer have any
+        self.documents.discard(document)
+        self.document_mask &= ~(1 << document)
+        self.facts.pop(document, None)
+        for target_node, relationships in list(self.edges.items()):
+            if not self.edge_masks[target_node] >> document & 1:
+                continue
+            remaining = {rel for rel in relationships if rel.document_source != document}
+            if remaining:
+                self.edges[target_node] = remaining
+                self.edge_masks[target_node] &= ~(1 << document)
+            else:
+                del self.edges[target_node]
+                del self.edge_masks[target_node]
+
+    def edge_mask(self, target_node: 'Node') -> int:
+        return self.edge_masks.get(target_node, 0)
+
+    def is_empty(self) -> bool:
+        return not self.documents and not self.facts and not self.edges
+
+    def get_edge_weight(self, target_node: 'Node', permissions: Permissions) -> int:
         # Returns the number of relationships in the edge to target_node that can be accessed based on permissions
-        return sum(1 for relationship in self.edges[target_node] if relationship.document_permissions.intersection(permissions))
+        permission_mask = compile_permissions(permissions)
+        return sum(1 for relationship in self.edges[target_node] if 1 << relationship.document_source & permission_mask)
     
     def __hash__(self) -> int:
         return hash(self.name)
@@ -1,82 +1,203 @@
-from dataclasses import dataclass, field
-from typing import List, Union, Set
+from typing import Dict, List, Optional, Set, Tuple, Union
 from .node import Node
 from .relationship import Relationship
+from .compact_graph import CompactNode
+from .permissions import Permissions, compile_permissions
+
+# Paths may hold nodes from either graph representation
+NODE_TYPES = (Node, CompactNode)
+
+# Rendered nodes keyed by (name, permission mask); only valid while the nodes don't change
+RenderCache = Dict[Tuple[str, int], str]
+
+def render_node(node: Node, permission_mask: int, cache: Optional[RenderCache] = None) -> str:
+    key = (node.name, permission_mask)
+    if cache is not None and key in cache:
+        return cache[key]
+    # Sorted so the same path always renders the same text (prompts stay cacheable across runs)
+    permitted_facts = [fact for doc_id, facts in sorted(node.facts.items())
+                       if 1 << doc_id & permission_mask
+                       for fact in sorted(facts)]
+    rendered = f"{node.name}, Facts: {{{', '.join(permitted_facts)}}}" if permitted_facts else f"{node.name}"
+    if cache is not None:
+        cache[key] = rendered
+    return rendered
+
+def render_edge(relationships: Set[Relationship], prev_node: Optional[str], next_node: Optional[str], permission_mask: int) -> str:
+    backward_rels = []
+    forward_rels = []
+    for rel in sorted(relationships, key=lambda rel: (rel.information, rel.document_source)):
+        if rel.document_mask() & permission_mask:
+            (backward_rels if rel.backwards else forward_rels).append(rel.information)
+
+    rel_strs = []
+    if backward_rels:
+        rel_strs.append(f"from {next_node} to {prev_node}: {', '.join(backward_rels)}")
+    if forward_rels:
+        rel_strs.append(f"from {prev_node} to {next_node}: {', '.join(forward_rels)}")
+    return f"[{', '.join(rel_strs)}]" if rel_strs else ""
+
+class _Link:
+    # One immutable step of a path. Paths extended from the same prefix share its links.
+    __slots__ = ("parent", "element", "is_node", "length", "hash", "first_hop")
+
+    def __init__(self, parent: Optional['_Link'], element, is_node: bool):
+        self.parent = parent
+        self.element = element
+        self.is_node = is_node
+        self.length = parent.length + 1 if parent is not None else 1
+        # Paths through the same nodes in the same order hash alike; edges follow from the nodes
+        parent_hash = parent.hash if parent is not None else 0
+        self.hash = hash((parent_hash, element.name)) if is_node else parent_hash
+        # The node after the first edge, carried down the chain so it can be read without walking back to it
+        self.first_hop = element if self.length == 3 else parent.first_hop if self.length > 3 else None
 
-@dataclass
 class Path:
-    elements: List[Union[Node, Set[Relationship]]] = field(default_factory=list)
+    # A path alternates nodes and edges (sets of relationships), starting with a node. It is stored as a
+    # chain of parent pointers to immutable links, so copying and extending are O(1) whatever the path's
+    # length, and every option of a bfs shares the explored path it extends instead of copying it.
+    # Equal paths (same nodes and edges in order) hash alike; don't change a path while it is used as a key.
+    __slots__ = ("_tail",)
 
     def __init__(self):
-        self.elements = []
+        self._tail: Optional[_Link] = None
+
+    @property
+    def elements(self) -> List[Union[Node, CompactNode, Set[Relationship]]]:
+        # Built on demand (O(length)); prefer last_node and tail when only the end matters
+        return self.tail(self._tail.length if self._tail is not None else 0)
+
+    def tail(self, count: int) -> List[Union[Node, CompactNode, Set[Relationship]]]:
+        # The last `count` elements, in order
+        elements = []
+        link = self._tail
+        while link is not None and len(elements) < count:
+            elements.append(link.element)
+            link = link.parent
+        elements.reverse()
+        return elements
 
     def add_node(self, node: Node) -> None:
-        if not self.elements or isinstance(self.elements[-1], Set):
-            self.elements.append(node)
+        if self._tail is None or not self._tail.is_node:
+            self._tail = _Link(self._tail, node, True)
         else:
             raise ValueError("Cannot add a node after another node. Add relationships in between.")
 
     def add_edge(self, relationships: Set[Relationship]) -> None:
-        if self.elements and isinstance(self.elements[-1], Node):
-            self.elements.append(relationships)
+        if self._tail is not None and self._tail.is_node:
+            self._tail = _Link(self._tail, relationships, False)
         else:
             raise ValueError("Cannot add edge to an empty path or after other edges. Add a node first.")
+
+    def extend(self, relationships: Set[Relationship], node: Node) -> 'Path':
+        # A new path continuing this one by an edge and a node; this path is unchanged
+        new_path = self.copy()
+        new_path.add_edge(relationships)
+        new_path.add_node(node)
+        return new_path
         
     def last_node(self) -> Node:
-        if not self.elements:
+        if self._tail is None:
             return None
-        return self.elements[-1]
+        return self._tail.element
     
+    def first_hop(self) -> Optional[Node]:
+        # The second node of the path (O(1)), or None for a path of a single node
+        return self._tail.first_hop if self._tail is not None else None
+
     def get_nodes(self) -> List[Node]:
-        return [element for element in self.elements if isinstance(element, Node)]
+        return [element for element in self.elements if isinstance(element, NODE_TYPES)]
     
     def pop(self, times: int = 1) -> None:
         for _ in range(times):
-            if self.elements:
-                self.elements.pop()
+            if self._tail is not None:
+                self._tail = self._tail.parent
             else:
                 break
 
     def copy(self) -> 'Path':
         new_path = Path()
-        new_path.elements = self.elements.copy()
+        new_path._tail = self._tail
         return new_path
 
-    def to_string(self, permissions: Set[int] = {-1}) -> str:
+    def __len__(self) -> int:
+        return self._tail.length if self._tail is not None else 0
+
+    def __hash__(self) -> int:
+        return self._tail.hash if self._tail is not None else 0
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Path):
+            return NotImplemented
+        a, b = self._tail, other._tail
+        # Stops as soon as the two chains meet in a shared prefix
+        while a is not b:
+            if a is None or b is None or a.length != b.length or a.hash != b.hash or a.is_node != b.is_node:
+                return False
+            if a.element is not b.element and a.element != b.element:
+                return False
+            a, b = a.parent, b.parent
+        return True
+
+    def to_string(self, permissions: Permissions = {-1}, cache: Optional[RenderCache] = None) -> str:
+        permission_mask = compile_permissions(permissions)
         result = []
-        for i, element in enumerate(self.elements):
-            if isinstance(element, Node):
-                permitted_facts = [fact for doc_id, facts in element.facts.items() 
-                                   for fact in facts 
-                                   if -1 in permissions or doc_id in permissions]
-                if permitted_facts:
-                    result.append(f"{element.name}, Facts: {{{', '.join(permitted_facts)}}}")
-                else:
-                    result.append(f"{element.name}")
+        elements = self.elements
+        for i, element in enumerate(elements):
+            if isinstance(element, NODE_TYPES):
+                result.append(render_node(element, permission_mask, cache))
             else:  # Set of Relationships
-                backward_rels = []
-                forward_rels = []
                 prev_node = next_node = None
-                if i > 0 and isinstance(self.elements[i-1], Node):
-                    prev_node = self.elements[i-1].name
-                if i < len(self.elements) - 1 and isinstance(self.elements[i+1], Node):
-                    next_node = self.elements[i+1].name
-                
-                for rel in element:
-                    if -1 in permissions or rel.document_source in permissions:
-                        (backward_rels if rel.backwards else forward_rels).append(rel.information)
-                
-                rel_strs = []
-                if backward_rels:
-                    rel_strs.append(f"from {next_node} to {prev_node}: {', '.join(backward_rels)}")
-                if forward_rels:
-                    rel_strs.append(f"from {prev_node} to {next_node}: {', '.join(forward_rels)}")
-                
-                if rel_strs:
-                    result.append(f"[{', '.join(rel_strs)}]")
+                if i > 0 and isinstance(elements[i-1], NODE_TYPES):
+                    prev_node = elements[i-1].name
+                if i < len(elements) - 1 and isinstance(elements[i+1], NODE_TYPES):
+                    next_node = elements[i+1].name
+                rendered = render_edge(element, prev_node, next_node, permission_mask)
+                if rendered:
+                    result.append(rendered)
         
         return " -> ".join(result)
 
+    def parent_path(self) -> Optional['Path']:
+        # The path without its last edge and node (O(1)), or None for a path of a single node
+        if self._tail is None or self._tail.parent is None or self._tail.parent.parent is None:
+            return None
+        parent = Path()
+        parent._tail = self._tail.parent.parent
+        return parent
+
     def __repr__(self) -> str:
         return self.to_string()
 
+
+def render_option_tree(options: List[Path], permission_mask: int, cache: Optional[RenderCache] = None) -> Tuple[List[str], List[str]]:
+    # Compact rendering of a bfs step: every explored path is rendered once, as a delta from the explored path
+    # it extends ("path_1: path_0 -> [edge] -> node"), and every option as a delta from the path it extends,
+    # so the prompt grows with the explored tree plus one edge and node per option rather than options x length.
+    # Returns (explored path lines, option lines), the option lines in the order of `options`.
+    ids: Dict[Path, int] = {}
+    explored = []
+
+    def delta(path: Path, parent: Optional[Path]) -> str:
+        node = render_node(path.last_node(), permission_mask, cache)
+        if parent is None:
+            return node
+        prev_node, edge, _ = path.tail(3)
+        rendered_edge = render_edge(edge, prev_node.name, path.last_node().name, permission_mask)
+        return " -> ".join(part for part in (f"path_{ids[parent]}", rendered_edge, node) if part)
+
+    option_lines = []
+    for i, option in enumerate(options):
+        parent = option.parent_path()
+        # Number any explored paths this option extends that haven't been rendered yet, shortest first
+        unseen = []
+        prefix = parent
+        while prefix is not None and prefix not in ids:
+            unseen.append(prefix)
+            prefix = prefix.parent_path()
+        for path in reversed(unseen):
+            path_parent = path.parent_path()
+            ids[path] = len(explored)
+            explored.append(f"path_{ids[path]}: {delta(path, path_parent)}")
+        option_lines.append(f"option_{i}: {delta(option, parent)}")
+    return explored, option_lines
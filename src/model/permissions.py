@@ -0,0 +1,22 @@
+from typing import Iterable, Set, Union
+
+# Permissions are compiled once into a bitmask with bit i set for document i, and nodes and edges carry
+# the same kind of mask for the documents they come from. Every access check is then a single AND,
+# no matter how many documents the user can see. -1 (global access) has every bit set.
+ALL_DOCUMENTS = -1
+
+Permissions = Union[Set[int], int]
+
+def document_mask(documents: Iterable[int]) -> int:
+    mask = 0
+    for document in documents:
+        mask |= 1 << document
+    return mask
+
+def compile_permissions(permissions: Permissions) -> int:
+    # Accepts a set of document ids (-1 meaning every document) or an already compiled mask
+    if isinstance(permissions, int):
+        return permissions
+    if -1 in permissions:
+        return ALL_DOCUMENTS
+    return document_mask(permissions)
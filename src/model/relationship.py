@@ -3,6 +3,8 @@ from typing import Set
 
 @dataclass
 class Relationship:
+    __slots__ = ('information', 'document_source', 'backwards')
+
     information: str
     document_source: int
     backwards: bool
@@ -27,11 +29,5 @@ class Relationship:
     def __repr__(self) -> str:
         return self.__str__()
 
-    def add_permission(self, permission: int) -> None:
-        self.document_permissions.add(permission)
-
-    def remove_permission(self, permission: int) -> None:
-        self.document_permissions.discard(permission)
-
-    def has_permission(self, permission: int) -> bool:
-        return permission in self.document_permissions
+    def document_mask(self) -> int:
+        return 1 << self.document_source
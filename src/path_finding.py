@@ -0,0 +1,123 @@
+import heapq
+from itertools import combinations
+from typing import Dict, List, Mapping, Optional, Set, Tuple
+from model.node import Node
+from model.path import Path
+from model.permissions import ALL_DOCUMENTS
+
+# Local routes between entities a query names, found without the model. Graphs are searched through the shared
+# node interface (edges and edge_mask), so plain graphs, permitted views and compact graphs all work, and only
+# edges the permission mask can see are followed.
+
+# Longest connecting path worth showing the model; anything longer is rarely what a question means
+MAX_PATH_HOPS = 6
+
+# Shortest paths kept per pair of entities
+PATHS_PER_PAIR = 3
+
+# Most mentioned entities connected with each other (every pair of them is searched)
+MAX_CONNECTED_ENTITIES = 4
+
+def neighbors(graph: Mapping[str, Node], name: str, permission_mask: int) -> List[str]:
+    node = graph[name]
+    return [neighbor.name for neighbor in node.edges if node.edge_mask(neighbor) & permission_mask and neighbor.name in graph]
+
+def shortest_path(graph: Mapping[str, Node], source: str, target: str, permission_mask: int = ALL_DOCUMENTS,
+                  max_hops: int = MAX_PATH_HOPS, banned_nodes: Set[str] = frozenset(),
+                  banned_edges: Set[Tuple[str, str]] = frozenset()) -> Optional[List[str]]:
+    # Bidirectional breadth first search: grows whichever side has the smaller frontier one level at a time, so
+    # around hubs it touches far fewer nodes than searching from one end. Returns the node names from source to
+    # target, or None if they aren't connected within max_hops.
+    if source == target:
+        return [source]
+    if source in banned_nodes or target in banned_nodes or source not in graph or target not in graph:
+        return None
+    # Each side maps the nodes it reached to (the node it reached them from, hops from its end)
+    forward: Dict[str, Tuple[Optional[str], int]] = {source: (None, 0)}
+    backward: Dict[str, Tuple[Optional[str], int]] = {target: (None, 0)}
+    forward_frontier, backward_frontier = [source], [target]
+    hops = 0
+    while forward_frontier and backward_frontier and hops < max_hops:
+        grow_forward = len(forward_frontier) <= len(backward_frontier)
+        frontier, reached, other = (forward_frontier, forward, backward) if grow_forward else (backward_frontier, backward, forward)
+        next_frontier = []
+        # The whole level is grown before stopping, since where the sides first meet isn't always the closest meeting
+        meeting = None
+        for name in frontier:
+            depth = reached[name][1] + 1
+            for neighbor in neighbors(graph, name, permission_mask):
+                if neighbor in reached or neighbor in banned_nodes:
+                    continue
+                # Edges are banned in the source to target direction
+                if (name, neighbor) in banned_edges if grow_forward else (neighbor, name) in banned_edges:
+                    continue
+                reached[neighbor] = (name, depth)
+                if neighbor in other:
+                    if depth + other[neighbor][1] <= max_hops and (meeting is None or other[neighbor][1] < other[meeting][1]):
+                        meeting = neighbor
+                else:
+                    next_frontier.append(neighbor)
+        hops += 1
+        if meeting is not None:
+            path = []
+            name = meeting
+            while name is not None:
+                path.append(name)
+                name = forward[name][0]
+            path.reverse()
+            name = backward[meeting][0]
+            while name is not None:
+                path.append(name)
+                name = backward[name][0]
+            return path
+        if grow_forward:
+            forward_frontier = next_frontier
+        else:
+            backward_frontier = next_frontier
+    return None
+
+def k_shortest_paths(graph: Mapping[str, Node], source: str, target: str, k: int = PATHS_PER_PAIR,
+                     permission_mask: int = ALL_DOCUMENTS, max_hops: int = MAX_PATH_HOPS) -> List[List[str]]:
+    # Yen's algorithm over hop counts: the k shortest loopless paths, shortest first. Each further path branches
+    # off a path already found at some node (the spur), with the edges the found paths take from there banned.
+    first = shortest_path(graph, source, target, permission_mask, max_hops)
+    if first is None:
+        return []
+    found = [first]
+    seen = {tuple(first)}
+    candidates: List[Tuple[int, int, List[str]]] = []
+    while len(found) < k:
+        last = found[-1]
+        for i in range(len(last) - 1):
+            root = last[:i + 1]
+            banned_edges = {(path[i], path[i + 1]) for path in found if path[:i + 1] == root and len(path) > i + 1}
+            spur = shortest_path(graph, last[i], target, permission_mask, max_hops - i, set(root[:-1]), banned_edges)
+            if spur is not None:
+                candidate = root[:-1] + spur
+                if tuple(candidate) not in seen:
+                    seen.add(tuple(candidate))
+                    heapq.heappush(candidates, (len(candidate), len(seen), candidate))
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates)[2])
+    return found
+
+def to_path(graph: Mapping[str, Node], names: List[str]) -> Path:
+    path = Path()
+    path.add_node(graph[names[0]])
+    for prev, name in zip(names, names[1:]):
+        node = graph[name]
+        path.add_edge(graph[prev].edges[node])
+        path.add_node(node)
+    return path
+
+def connecting_paths(graph: Mapping[str, Node], entities: List[str], permission_mask: int = ALL_DOCUMENTS,
+                     k: int = PATHS_PER_PAIR, max_hops: int = MAX_PATH_HOPS) -> List[Tuple[str, str, Path]]:
+    # The k shortest paths between every pair of the first MAX_CONNECTED_ENTITIES entities, as (source, target,
+    # path), pair by pair in mention order and shortest first within a pair
+    entities = [name for name in entities if name in graph][:MAX_CONNECTED_ENTITIES]
+    paths = []
+    for source, target in combinations(entities, 2):
+        for names in k_shortest_paths(graph, source, target, k, permission_mask, max_hops):
+            paths.append((source, target, to_path(graph, names)))
+    return paths
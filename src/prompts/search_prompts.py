@@ -25,7 +25,7 @@ Based on the information provided, please determine if we already have enough in
 
 If 'complete' is False, determine which next step will give the best chance of eventually answering the question, even if it doesn't provide much more detail immediately.
 
-Note that for each option, only the last edge and node are new; the rest of the path has already been explored.
+The paths explored so far are listed once, each as an earlier explored path (path_N) extended by one edge and node. Each option extends one explored path by one new edge and node.
 
 When selecting the next step:
 1. Choose the option that you believe will lead us closer to answering the query, even if it doesn't provide immediate answers.
@@ -37,7 +37,10 @@ Always select a next step, even if you set 'complete' to True.
 Remember to consider the context of the query and the information we've gathered so far when making your decision.
 
 Query: {query}
-Options: {options_string}
+Explored paths:
+{explored_string}
+Options:
+{options_string}
 """
 
 ANSWER_SYSTEM_PROMPT = """
@@ -75,4 +78,38 @@ Remember to:
 - Use the information from the final path and the reasoning provided to support your answer
 - Be concise yet comprehensive in your explanation
 - In the third section, acknowledge any potential inaccuracies or limitations of your answer
-"""
\ No newline at end of file
+"""
+SEARCH_BEAM_SYSTEM_PROMPT = """
+You are an AI designed to assist in a graph search algorithm. Your task is to analyze the current paths explored and determine the next steps to explore, as well as whether the current information is sufficient to answer the original query.
+
+Instructions:
+1. Review the paths explored so far and the original query.
+2. Determine if the information gathered so far is sufficient to answer the query.
+3. If the current information is enough to answer the query without exploring any further, set 'complete' to True.
+4. If more information is needed to answer the query, set 'complete' to False.
+5. Regardless of whether 'complete' is True or False, select the most promising 'next_steps' to explore based on their potential to provide relevant information for the query, most promising first.
+6. Note that there may not be an obvious next step that will bring us much closer to answering the question, but we should still pick the best choices among the available options.
+"""
+
+SEARCH_BEAM_USER_PROMPT = """
+Based on the information provided, please determine if we already have enough information to answer the question without taking any extra steps. If we do, set 'complete' to True. Otherwise, set 'complete' to False.
+
+If 'complete' is False, determine which next steps will give the best chance of eventually answering the question, even if they don't provide much more detail immediately. All of the steps you select are explored at once.
+
+The paths explored so far are listed once, each as an earlier explored path (path_N) extended by one edge and node. Each option extends one explored path by one new edge and node.
+
+When selecting the next steps:
+1. Select between 1 and {beam_width} options, most promising first. Only select more than one if each of them could lead us closer to answering the query.
+2. Consider how these steps might open up new paths or connections that could be valuable later.
+3. Remember that the best next steps might not directly relate to the answer, but could provide crucial context or lead to important connections.
+
+Always select at least one next step, even if you set 'complete' to True.
+
+Remember to consider the context of the query and the information we've gathered so far when making your decision.
+
+Query: {query}
+Explored paths:
+{explored_string}
+Options:
+{options_string}
+"""
@@ -0,0 +1,62 @@
+import math
+import re
+from collections import Counter
+from typing import Callable, List, Optional, Tuple
+from model.path import NODE_TYPES, Path
+
+# A scorer takes the query and one text per option and returns one score per option (higher is better)
+OptionScorer = Callable[[str, List[str]], List[float]]
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+class BM25Scorer:
+    # Okapi BM25 with the options themselves as the corpus, so rare terms shared with the query stand out
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def __call__(self, query: str, texts: List[str]) -> List[float]:
+        documents = [tokenize(text) for text in texts]
+        if not documents:
+            return []
+        average_length = sum(len(doc) for doc in documents) / len(documents) or 1
+        document_frequency = Counter(term for doc in documents for term in set(doc))
+        query_terms = set(tokenize(query))
+
+        scores = []
+        for doc in documents:
+            term_counts = Counter(doc)
+            score = 0.0
+            for term in query_terms:
+                count = term_counts.get(term)
+                if not count:
+                    continue
+                idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                score += idf * count * (self.k1 + 1) / (count + self.k1 * (1 - self.b + self.b * len(doc) / average_length))
+            scores.append(score)
+        return scores
+
+def option_text(option: Path, permission_mask: int) -> str:
+    # Only the last edge and node of an option are new, so that is all that is scored
+    parts = []
+    for element in option.tail(2):
+        if isinstance(element, NODE_TYPES):
+            parts.append(element.name)
+            parts.extend(fact for doc_id, facts in element.facts.items() if 1 << doc_id & permission_mask for fact in facts)
+        else:
+            parts.extend(rel.information for rel in element if rel.document_mask() & permission_mask)
+    return " ".join(parts)
+
+def prune_options(query: str, options: List[Path], permission_mask: int, top_k: Optional[int],
+                  scorer: Optional[OptionScorer] = None) -> Tuple[List[Path], int]:
+    # Keeps the top_k best scoring options (in their original order) and returns them with the number pruned
+    if top_k is None or len(options) <= top_k:
+        return options, 0
+    scorer = scorer or BM25Scorer()
+    scores = scorer(query, [option_text(option, permission_mask) for option in options])
+    # Ties go to the option discovered first
+    best = sorted(range(len(options)), key=lambda i: (-scores[i], i))[:top_k]
+    return [options[i] for i in sorted(best)], len(options) - top_k
@@ -0,0 +1,67 @@
+import random
+import threading
+import time
+from typing import Callable, Optional, Tuple, Type, TypeVar
+
+T = TypeVar("T")
+
+class RateLimiter:
+    # Token-bucket limiter shared by every worker thread. Each bucket holds up to one minute
+    # of budget and refills continuously, so short bursts are allowed but the average rate
+    # never exceeds the configured requests/tokens per minute.
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_budget = float(requests_per_minute or 0)
+        self._token_budget = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_budget = min(self.requests_per_minute, self._request_budget + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._token_budget = min(self.tokens_per_minute, self._token_budget + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens: int = 0) -> None:
+        # Blocks until both one request and `tokens` tokens are available
+        if self.tokens_per_minute:
+            # A single request larger than the whole bucket would otherwise wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._request_budget < 1:
+                    wait = max(wait, (1 - self._request_budget) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._token_budget < tokens:
+                    wait = max(wait, (tokens - self._token_budget) * 60 / self.tokens_per_minute)
+                if wait == 0.0:
+                    if self.requests_per_minute:
+                        self._request_budget -= 1
+                    if self.tokens_per_minute:
+                        self._token_budget -= tokens
+                    return
+            time.sleep(wait)
+
+def estimate_tokens(text: str) -> int:
+    # Rough heuristic (~4 characters per token) that is good enough for budgeting
+    return len(text) // 4 + 1
+
+def retry_with_backoff(fn: Callable[[], T], max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                       retry_on: Tuple[Type[BaseException], ...] = (Exception,)) -> T:
+    # Calls fn, retrying transient failures with exponential backoff and full jitter
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt >= max_retries:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"Request failed ({type(e).__name__}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            attempt += 1
@@ -1,127 +1,400 @@
-import os
-from typing import Dict
-from openai import OpenAI
-from dotenv import load_dotenv
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Type, Union
 from model.node import Node
 from model.relationship import Relationship
-from model.path import Path
+from model.path import Path, RenderCache, render_option_tree
+from model.frontier import Frontier
+from ranking import OptionScorer, prune_options
+from entity_index import get_entity_index
+from path_finding import connecting_paths
+from response_cache import ResponseCache
+from llm_backend import cache_model, get_backend
+from tracing import current_span, propagate, span, span_steps
+from model.permissions import Permissions, compile_permissions
+from model.graph import derived_data
+from model.graph_view import permitted_view
 from enum import Enum
 from pydantic import BaseModel
-from prompts.search_prompts import SOURCE_SYSTEM_PROMPT, SEARCH_SYSTEM_PROMPT, SEARCH_USER_PROMPT, ANSWER_SYSTEM_PROMPT, ANSWER_USER_PROMPT
+from prompts.search_prompts import (SOURCE_SYSTEM_PROMPT, SEARCH_SYSTEM_PROMPT, SEARCH_USER_PROMPT, SEARCH_BEAM_SYSTEM_PROMPT,
+                                    SEARCH_BEAM_USER_PROMPT, ANSWER_SYSTEM_PROMPT, ANSWER_USER_PROMPT)
 
-# Load environment variables
-load_dotenv()
+SEARCH_MODEL = "gpt-4o-2024-08-06"
 
-# Set up OpenAI API key
-OpenAI.api_key = os.getenv("OPENAI_API_KEY")
+# Repeated questions (same query, candidates, options and permissions) are answered from disk; set to None to disable
+response_cache: Optional[ResponseCache] = ResponseCache()
 
-# Initialize OpenAI client
-client = OpenAI()
+# Most options the model sees per step; the rest are pruned by a local relevance score
+DEFAULT_TOP_K = 50
 
-def search(graph: Dict[str, Node], query: str, depth: int, permissions: set() = {-1}):
-    if -1 in permissions:
-        node_names = Enum('Entity', {x: x for x in graph.keys()})
-    else:
-        node_names = Enum('Entity', {x: x for x in graph.keys() if any(doc in permissions for doc in graph[x].documents)})
-    # Select a source node
-    source_name = select_source_node(node_names, query)
+# Most entities offered to the model when choosing where to start
+MAX_SOURCE_CANDIDATES = 20
+
+# What a search does with the paths found locally between the entities a query names: "seed" starts the
+# search from them, "answer" answers from them straight away, and None always starts from a single source
+FAST_PATH_MODES = ("seed", "answer", None)
+
+class SourceSelected(NamedTuple):
+    source: str
+
+class PathsFound(NamedTuple):
+    # The query named several entities and these paths connect them, so the search starts from (or answers
+    # from) them instead of a single source
+    entities: List[str]
+    paths: List[Path]
+
+class SearchStep(NamedTuple):
+    step: int
+    # Each option as "option_i: path_j -> [edge] -> node", extending one of the explored paths
+    options: List[str]
+    pruned: int
+    reasoning: str
+    complete: bool
+    choice: int
+    path: Path
+    explored: Sequence[str] = ()
+    # Every option taken by this call (choice and path are the first of them) and which of the step's
+    # parallel calls made it; in the default mode that is always one option and branch 0
+    choices: Sequence[int] = ()
+    paths: Sequence[Path] = ()
+    branch: int = 0
+
+class SearchFinished(NamedTuple):
+    # result is None if the search was cancelled; stopped is None when it ran to completion, otherwise
+    # "cancelled" or "deadline" (the deadline still answers from the steps taken so far)
+    result: Optional[BaseModel]
+    history: list
+    stopped: Optional[str]
+
+SearchEvent = Union[SourceSelected, PathsFound, SearchStep, SearchFinished]
+
+def search(graph: Dict[str, Node], query: str, depth: int, permissions: Permissions = {-1}, top_k: Optional[int] = DEFAULT_TOP_K,
+           scorer: Optional[OptionScorer] = None, cancel: Optional[threading.Event] = None, deadline: Optional[float] = None,
+           beam_width: int = 1, branches: int = 1, fast_path: Optional[str] = "seed"):
+    for event in search_steps(graph, query, depth, permissions, top_k, scorer, cancel, deadline, beam_width, branches, fast_path):
+        if isinstance(event, SourceSelected):
+            print("Question: " + query)
+            print("Optimal starting entity: " + event.source)
+            print("Starting search ...")
+        elif isinstance(event, PathsFound):
+            print("Question: " + query)
+            print(f"Found {len(event.paths)} paths connecting " + ", ".join(event.entities))
+            print("Starting search ...")
+        elif isinstance(event, SearchStep):
+            print_step(event)
+    if event.result is not None:
+        print(event.result.best_guess)
+        print(event.result.positive_explation)
+        print(event.result.potential_issues)
+    return event.result, event.history
+
+def search_steps(graph: Dict[str, Node], query: str, depth: int, permissions: Permissions = {-1}, top_k: Optional[int] = DEFAULT_TOP_K,
+                 scorer: Optional[OptionScorer] = None, cancel: Optional[threading.Event] = None,
+                 deadline: Optional[float] = None, beam_width: int = 1, branches: int = 1,
+                 fast_path: Optional[str] = "seed") -> Iterator[SearchEvent]:
+    # Streaming form of search: yields the chosen source, then every step as it is taken, and finally a
+    # SearchFinished with the answer. Setting `cancel` stops before the next model call without an answer;
+    # once `deadline` (a time.time() timestamp) passes, the search answers from the steps taken so far.
+    # Both are checked between model calls, so a request already in flight is allowed to finish.
+    # beam_width and branches are passed on to bfs_steps, and fast_path is one of FAST_PATH_MODES.
+    return span_steps("search", _search_steps(graph, query, depth, permissions, top_k, scorer, cancel, deadline, beam_width,
+                                              branches, fast_path),
+                      query=query, depth=depth, beam_width=beam_width, branches=branches)
+
+def _search_steps(graph: Dict[str, Node], query: str, depth: int, permissions: Permissions, top_k: Optional[int],
+                  scorer: Optional[OptionScorer], cancel: Optional[threading.Event], deadline: Optional[float],
+                  beam_width: int, branches: int, fast_path: Optional[str]) -> Iterator[SearchEvent]:
+    # Runs as the search span (see tracing.span_steps), so spans started here are its children
+    search_span = current_span()
+    permission_mask = compile_permissions(permissions)
+    # Search over the cached view of what these permissions can see, so nothing below has to filter
+    with span("permission_filtering"):
+        graph = permitted_view(graph, permission_mask)
+
+    if cancel is not None and cancel.is_set():
+        yield SearchFinished(None, [], "cancelled")
+        return
+
+    entity_index = get_entity_index(graph)
+
+    # When the query names several entities, the shortest permitted paths between them are found locally, so
+    # the model doesn't have to walk from one to the other a hop at a time
+    if fast_path is not None:
+        with span("path_finding") as path_span:
+            mentioned = entity_index.mentioned(query)
+            connections = connecting_paths(graph, mentioned, permission_mask) if len(mentioned) > 1 else []
+            path_span.set(entities=len(mentioned), paths=len(connections))
+        if connections:
+            history = [(f"Shortest permitted paths from {source} to {target}, found locally", path)
+                       for source, target, path in connections]
+            paths = [path for _, _, path in connections]
+            yield PathsFound(mentioned, paths)
+            if fast_path == "answer":
+                search_span.set(steps=0, stopped=None)
+                yield SearchFinished(solidify_answer(query, history), history, None)
+                return
+            for event in bfs_steps(graph, query, paths, set(), depth, history, permission_mask, top_k, scorer, cancel,
+                                   deadline, beam_width, branches):
+                if isinstance(event, SearchFinished):
+                    search_span.set(steps=len(event.history) - len(connections), stopped=event.stopped)
+                yield event
+            return
+
+    # Select a source node, skipping the model entirely when the query names exactly one entity
+    with span("source_selection") as source_span:
+        source_name = entity_index.unambiguous_match(query)
+        if source_name is None:
+            # Without a close match, fall back to the weaker fuzzy matches and then to the best connected
+            # entities, so the schema never grows with the graph
+            candidates = (entity_index.lookup(query, MAX_SOURCE_CANDIDATES)
+                          or entity_index.lookup(query, MAX_SOURCE_CANDIDATES, min_score=0.0)
+                          or heapq.nlargest(MAX_SOURCE_CANDIDATES, graph, key=lambda name: len(graph[name].edges)))
+            source_span.set(candidates=len(candidates))
+            node_names = Enum('Entity', {x: x for x in candidates})
+            source_name = select_source_node(node_names, query)
+        source_span.set(source=source_name)
     source_node = graph[source_name]
-    print("Question: " + query)
-    print("Optimal starting entity: " + source_name)
+    yield SourceSelected(source_name)
 
     # Create our starting path
     path = Path()
     path.add_node(source_node)
 
     # Begin search
-    print("Starting search ...")
-    result, history = bfs(graph, query, [path], set([source_node]), depth, [], permissions)
-    print(result.best_guess)
-    print(result.positive_explation)
-    print(result.potential_issues)
-    return result, history
+    for event in bfs_steps(graph, query, [path], set([source_node]), depth, [], permission_mask, top_k, scorer, cancel, deadline,
+                           beam_width, branches):
+        if isinstance(event, SearchFinished):
+            search_span.set(steps=len(event.history), stopped=event.stopped)
+        yield event
+
+class SearchRequest(NamedTuple):
+    query: str
+    depth: int
+    permissions: Permissions = {-1}
+
+def batch_search(graph: Dict[str, Node], requests: Iterable[Tuple], max_workers: int = 8, top_k: Optional[int] = DEFAULT_TOP_K,
+                 scorer: Optional[OptionScorer] = None, return_exceptions: bool = False, beam_width: int = 1,
+                 branches: int = 1, fast_path: Optional[str] = "seed") -> List[Tuple]:
+    # Runs many (query, depth, permissions) searches concurrently over one graph and returns their
+    # (result, history) pairs in request order. Searches spend nearly all their time waiting on the model, so
+    # threads overlap that waiting; wrap the backend in a LimitedBackend to cap requests across everything
+    # sharing it. With return_exceptions a failed search returns its exception instead of failing the batch.
+    requests = [SearchRequest(*request) for request in requests]
+
+    # Build each permission set's view and entity index once up front rather than racing to build them per query
+    for permission_mask in {compile_permissions(request.permissions) for request in requests}:
+        get_entity_index(permitted_view(graph, permission_mask))
+
+    def run(request: SearchRequest):
+        try:
+            return search(graph, request.query, request.depth, request.permissions, top_k, scorer, beam_width=beam_width,
+                          branches=branches, fast_path=fast_path)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(propagate(run), requests))
 
 def select_source_node(nodes: Enum, query: str):
     class SourceNode(BaseModel):
         source: nodes
 
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
+    ans = parse_completion(
         messages=[
             {"role": "system", "content": SOURCE_SYSTEM_PROMPT},
             {"role": "user", "content": "Given the following question, select an entity that most closely matches something DIRECTLY MENTIONED in the question: " + query}
         ],
         response_format=SourceNode,
     )
-
-    ans = completion.choices[0].message.parsed
     return ans.source.name
 
 # bfs - BEST First Search
-def bfs(graph: Dict[str, Node], query: str, paths: list[Path], visited: set(), max_iterations: int, history: list[str, Path], permissions: set() = {-1}):
-    options = []
-    option_num_to_path_num = {}
-    for i, path in enumerate(paths): 
-        curr_path = Path()
-        for node in path.get_nodes():
-            curr_path.add_node(node)
-            for neighbor in node.edges.keys():
-                if neighbor not in visited and (-1 in permissions or any(rel.document_source in permissions for rel in node.edges[neighbor])):
-                    copy_curr_path = curr_path.copy()
-                    copy_curr_path.add_edge(node.edges[neighbor])
-                    copy_curr_path.add_node(graph[neighbor.name])
-                    option_num_to_path_num[len(options)] = i
-                    options.append(copy_curr_path)
-            next_edge_idx = i*2+1
-            if (len(path.elements) > next_edge_idx):
-                curr_path.add_edge(path.elements[next_edge_idx])
-    
-    # If no more possible paths (#TO-DO potentially add starting at another source node in different CC)
-    if not options:
-        return solidify_answer(query, history), history
-
-    options_enum = Enum('Option', {f'option_{i}': i for i in range(len(options))})
-    
-    class NextStep(BaseModel):
+def bfs(graph: Dict[str, Node], query: str, paths: list[Path], visited: set(), max_iterations: int, history: list[str, Path], permissions: Permissions = {-1},
+        top_k: Optional[int] = DEFAULT_TOP_K, scorer: Optional[OptionScorer] = None, cancel: Optional[threading.Event] = None,
+        deadline: Optional[float] = None, beam_width: int = 1, branches: int = 1):
+    for event in bfs_steps(graph, query, paths, visited, max_iterations, history, permissions, top_k, scorer, cancel, deadline,
+                           beam_width, branches):
+        if isinstance(event, SearchStep):
+            print_step(event)
+    return event.result, event.history
+
+def bfs_steps(graph: Dict[str, Node], query: str, paths: list[Path], visited: set(), max_iterations: int, history: list[str, Path],
+              permissions: Permissions = {-1}, top_k: Optional[int] = DEFAULT_TOP_K, scorer: Optional[OptionScorer] = None,
+              cancel: Optional[threading.Event] = None, deadline: Optional[float] = None, beam_width: int = 1,
+              branches: int = 1) -> Iterator[SearchEvent]:
+    # Each of the max_iterations steps asks the model for up to `beam_width` options to explore at once. With
+    # `branches` > 1 the step's options are split by the first hop they descend from into that many independent
+    # groups, each chosen from by its own model call, and the calls run in parallel. Every option taken is added
+    # to history as (reasoning, path), in the same format as the default one option per step search.
+    permission_mask = compile_permissions(permissions)
+    node_cache = render_cache(graph)
+
+    # Every node on the starting paths counts as explored, each reachable through its own prefix
+    frontier = Frontier(graph, permission_mask)
+    for path in paths:
+        prefix = Path()
+        for i, element in enumerate(path.elements):
+            if i % 2 == 0:
+                prefix.add_node(element)
+                visited.add(element)
+                frontier.visit(element)
+                frontier.expand(prefix, visited)
+            else:
+                prefix.add_edge(element)
+
+    executor = ThreadPoolExecutor(max_workers=branches, thread_name_prefix="search-branch") if branches > 1 else None
+    try:
+        # Iterative rather than recursive, so deep searches don't depend on the recursion limit
+        step = 0
+        while True:
+            if cancel is not None and cancel.is_set():
+                yield SearchFinished(None, history, "cancelled")
+                return
+            if deadline is not None and time.time() >= deadline:
+                yield SearchFinished(solidify_answer(query, history), history, "deadline")
+                return
+
+            with span("option_enumeration", step=step) as enumeration_span:
+                options = frontier.to_list()
+                # Hub nodes can have hundreds of neighbors, so only the most relevant options go to the model
+                options, pruned = prune_options(query, options, permission_mask, top_k, scorer)
+                enumeration_span.set(options=len(options), pruned=pruned)
+
+            # If no more possible paths (#TO-DO potentially add starting at another source node in different CC)
+            if not options:
+                yield SearchFinished(solidify_answer(query, history), history, None)
+                return
+
+            # The explored paths are rendered once and each option only as the edge and node it adds
+            groups = split_branches(options, branches)
+            with span("prompt_rendering", step=step):
+                rendered = [render_option_tree(group, permission_mask, node_cache) for group in groups]
+
+            def choose(tree: Tuple[List[str], List[str]]) -> Tuple[str, bool, List[int]]:
+                return choose_options(query, tree[0], tree[1], beam_width)
+            if executor is None or len(groups) == 1:
+                choices = [choose(tree) for tree in rendered]
+            else:
+                choices = list(executor.map(propagate(choose), rendered))
+
+            # Different branches can reach the same node, so each node is only taken once per step. Every choice
+            # holds at least one option and the first branch has nothing to clash with, so a step always takes one.
+            taken = []
+            taken_nodes = set()
+            complete = False
+            for branch, (group, tree, choice) in enumerate(zip(groups, rendered, choices)):
+                explored_string, options_string = tree
+                reasoning, group_complete, option_nums = choice
+                complete = complete or group_complete
+                kept = []
+                for i in option_nums:
+                    if group[i].last_node() not in taken_nodes:
+                        taken_nodes.add(group[i].last_node())
+                        kept.append(i)
+                if not kept:
+                    continue
+                paths_taken = [group[i] for i in kept]
+                for path_taken in paths_taken:
+                    history.append((reasoning, path_taken))
+                taken.extend(paths_taken)
+                yield SearchStep(step, options_string, pruned if branch == 0 else 0, reasoning, group_complete, kept[0],
+                                 paths_taken[0], explored_string, kept, paths_taken, branch)
+            if complete or max_iterations <= 1:
+                # Need to actually return all paths taken
+                if cancel is not None and cancel.is_set():
+                    yield SearchFinished(None, history, "cancelled")
+                else:
+                    yield SearchFinished(solidify_answer(query, history), history, None)
+                return
+
+            # Only the newly visited nodes' neighbors change the frontier
+            for path_taken in taken:
+                visited_node = path_taken.last_node()
+                visited.add(visited_node)
+                frontier.visit(visited_node)
+                frontier.expand(path_taken, visited)
+            max_iterations -= 1
+            step += 1
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+def split_branches(options: List[Path], branches: int) -> List[List[Path]]:
+    # Splits the options into up to `branches` groups by the first hop of their path, handing the first hops out
+    # round robin in option order, so each group covers its own part of the explored tree
+    if branches <= 1 or len(options) <= 1:
+        return [options]
+    groups: List[List[Path]] = [[] for _ in range(min(branches, len(options)))]
+    slots: Dict[Node, int] = {}
+    for option in options:
+        groups[slots.setdefault(option.first_hop(), len(slots) % len(groups))].append(option)
+    return [group for group in groups if group]
+
+def choose_options(query: str, explored_string: List[str], options_string: List[str], beam_width: int = 1) -> Tuple[str, bool, List[int]]:
+    # Asks the model which of the rendered options to explore next and returns (reasoning, complete, option
+    # numbers). One option per call keeps the original single next_step request.
+    options_enum = Enum('Option', {f'option_{i}': i for i in range(len(options_string))})
+
+    if beam_width <= 1:
+        class NextStep(BaseModel):
+            reasoning: str
+            complete: bool
+            next_step: options_enum
+
+        result = parse_completion(
+            messages=[
+                {"role": "system", "content": SEARCH_SYSTEM_PROMPT},
+                {"role": "user", "content": SEARCH_USER_PROMPT.format(query=query, explored_string="\n".join(explored_string),
+                                                                      options_string="\n".join(options_string))}
+            ],
+            response_format=NextStep,
+        )
+        return result.reasoning, result.complete, [int(result.next_step.name.split("_")[-1])]
+
+    class NextSteps(BaseModel):
         reasoning: str
         complete: bool
-        next_step: options_enum
-
-    options_string = [f"option_{i}: {option.to_string(permissions)}" for i, option in enumerate(options)]
+        next_steps: List[options_enum]
 
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
+    result = parse_completion(
         messages=[
-            {"role": "system", "content": SEARCH_SYSTEM_PROMPT},
-            {"role": "user", "content": SEARCH_USER_PROMPT.format(query=query, options_string=options_string)}
+            {"role": "system", "content": SEARCH_BEAM_SYSTEM_PROMPT},
+            {"role": "user", "content": SEARCH_BEAM_USER_PROMPT.format(query=query, beam_width=beam_width,
+                                                                       explored_string="\n".join(explored_string),
+                                                                       options_string="\n".join(options_string))}
         ],
-        response_format=NextStep,
+        response_format=NextSteps,
     )
+    # The schema can't bound the list, so repeats and anything past beam_width are dropped here; an empty
+    # selection takes the first option, as a single step search always takes one
+    option_nums = list(dict.fromkeys(int(step.name.split("_")[-1]) for step in result.next_steps))[:beam_width]
+    return result.reasoning, result.complete, option_nums or [0]
 
-    result = completion.choices[0].message.parsed
+def render_cache(graph: Dict[str, Node]) -> RenderCache:
+    # Rendered nodes for a graph, kept until the graph changes so every step and search reuses them
+    return derived_data(graph, 'render_cache', lambda _: {})
 
+def print_step(step: SearchStep) -> None:
     print("#--------------------------------------------------------------#")
+    print("Explored:")
+    for path in step.explored:
+        print(path)
     print("Options:")
-    for i, option in enumerate(options):
-        print(f"option_{i}: {option.to_string(permissions)}")
-    print("Reasoning: " + result.reasoning)
-    print("Complete?: " + str(result.complete))
-    print("Option Chosen: " + result.next_step.name)
-    print("#--------------------------------------------------------------#")
-
-    complete = result.complete
-    reasoning = result.reasoning
-    option_num = int(result.next_step.name.split("_")[-1])
-    path_taken_num = option_num_to_path_num[option_num]
-    paths[path_taken_num] = options[option_num]
-    history.append((reasoning, paths[path_taken_num]))
-    if complete or max_iterations <= 1:
-        # Need to actually return all paths taken
-        return solidify_answer(query, history), history
+    for option in step.options:
+        print(option)
+    if step.pruned:
+        print(f"Pruned {step.pruned} lower scoring options")
+    print("Reasoning: " + step.reasoning)
+    print("Complete?: " + str(step.complete))
+    if len(step.choices) > 1:
+        print("Options Chosen: " + ", ".join(f"option_{choice}" for choice in step.choices))
     else:
-        visited_node = paths[path_taken_num].last_node()
-        visited.add(visited_node)
-        return bfs(graph, query, paths, visited, max_iterations - 1, history, permissions)
+        print("Option Chosen: option_" + str(step.choice))
+    print("#--------------------------------------------------------------#")
 
 def solidify_answer(query: str, history: list[str, Path]):
     class Answer(BaseModel):
@@ -129,16 +402,31 @@ def solidify_answer(query: str, history: list[str, Path]):
         positive_explation: str
         potential_issues: str
 
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
+    with span("prompt_rendering", answer=True):
+        answer_prompt = ANSWER_USER_PROMPT.format(query=query, history=history)
+
+    return parse_completion(
         messages=[
             {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
-            {"role": "user", "content": ANSWER_USER_PROMPT.format(query=query, history=history)}
+            {"role": "user", "content": answer_prompt}
         ],
         response_format=Answer,
     )
 
-    return completion.choices[0].message.parsed
+def parse_completion(messages: List[dict], response_format: Type[BaseModel], model: str = SEARCH_MODEL) -> BaseModel:
+    # Structured-output completion, served from the response cache when this exact request was seen before
+    with span("llm", model=model, response_format=response_format.__name__) as llm_span:
+        key = ResponseCache.key(cache_model(model), messages, response_format) if response_cache is not None else None
+        if key is not None:
+            cached = response_cache.get(key)
+            llm_span.set(cache_hit=cached is not None)
+            if cached is not None:
+                return response_format.model_validate_json(cached)
+
+        parsed = get_backend().parse(model, messages, response_format)
+        if key is not None:
+            response_cache.put(key, parsed.model_dump_json())
+        return parsed
 
 
 
@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple, Union
+import search
+import tracing
+from graph_creator import create_knowledge_graph, documents_fingerprint, read_documents
+from llm_backend import LimitedBackend, get_backend, set_backend
+from model.compact_graph import CompactGraph
+from model.graph import KnowledgeGraph
+from model.permissions import compile_permissions
+
+# Headless search service that keeps the graph in memory between requests:
+#   python src/server.py --port 8000
+#   curl -d '{"query": "Who is Sue?", "depth": 3, "permissions": [0, 2]}' localhost:8000/search
+# GET /health and /stats report on the service, GET /metrics exports the tracing metrics for Prometheus,
+# and POST /reload rebuilds the graph now instead of waiting for the next document check. A search can also set
+# "beam_width" (options taken per model call), "branches" (parallel model calls per step) and "fast_path" (what to
+# do with local paths between the entities the query names: "seed", "answer" or null).
+
+class GraphService:
+    # Owns the live graph. A reload builds a complete new graph (only changed documents are re-extracted,
+    # thanks to the extraction cache) and then swaps it in, so searches never see a half-updated graph and
+    # searches already running finish on the graph they started with.
+    def __init__(self, documents_dir: str = "documents", snapshot_path: Optional[str] = "src/graph_info/graph.snapshot",
+                 max_workers: int = 4, compact: bool = False):
+        self.documents_dir = documents_dir
+        self.snapshot_path = snapshot_path
+        self.max_workers = max_workers
+        # Serve a CompactGraph, which holds large graphs in a fraction of the memory
+        self.compact = compact
+        self.graph: Union[KnowledgeGraph, CompactGraph] = KnowledgeGraph()
+        self.document_count = 0
+        self.fingerprint: Optional[bytes] = None
+        self.directory_state: Optional[List[Tuple[str, int, int]]] = None
+        self.loaded_at: Optional[float] = None
+        self.reloads = 0
+        self.requests = 0
+        self.errors = 0
+        self._reload_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+
+    def _directory_state(self) -> List[Tuple[str, int, int]]:
+        # Cheap change check: names, sizes and modification times of the documents
+        state = []
+        for filename in sorted(os.listdir(self.documents_dir)):
+            if filename.endswith(".txt"):
+                stat = os.stat(os.path.join(self.documents_dir, filename))
+                state.append((filename, stat.st_size, stat.st_mtime_ns))
+        return state
+
+    def reload(self, force: bool = False) -> bool:
+        # Rebuilds the graph if the documents changed, and returns whether it did
+        with self._reload_lock:
+            state = self._directory_state()
+            if not force and state == self.directory_state:
+                return False
+            documents = read_documents(self.documents_dir)
+            fingerprint = documents_fingerprint(documents)
+            if not force and fingerprint == self.fingerprint:
+                # Touched but not changed
+                self.directory_state = state
+                return False
+            with tracing.span("reload", documents=len(documents)):
+                graph = create_knowledge_graph(documents, max_workers=self.max_workers, snapshot_path=self.snapshot_path,
+                                               compact=self.compact)
+            # Only recorded once the new graph is live, so a failed reload is retried on the next check
+            self.graph, self.fingerprint, self.directory_state, self.loaded_at = graph, fingerprint, state, time.time()
+            self.document_count = len(documents)
+            self.reloads += 1
+            return True
+
+    def watch(self, interval: float) -> threading.Thread:
+        # Checks the documents for changes every `interval` seconds on a daemon thread
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Reload failed ({type(e).__name__}: {e}), still serving the previous graph")
+        thread = threading.Thread(target=loop, name="graph-reload", daemon=True)
+        thread.start()
+        return thread
+
+    def search(self, query: str, depth: int, permissions, top_k: Optional[int], beam_width: int = 1, branches: int = 1,
+               fast_path: Optional[str] = "seed") -> dict:
+        graph = self.graph
+        permission_mask = compile_permissions(permissions)
+        result, history = search.search(graph, query, depth, permissions, top_k, beam_width=beam_width, branches=branches,
+                                        fast_path=fast_path)
+        return {
+            "best_guess": result.best_guess,
+            "positive_explation": result.positive_explation,
+            "potential_issues": result.potential_issues,
+            "history": [{"reasoning": reasoning, "path": path.to_string(permission_mask)} for reasoning, path in history],
+            "graph_version": graph.version,
+        }
+
+    def count(self, error: bool = False) -> None:
+        with self._counter_lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+
+    def stats(self) -> dict:
+        graph = self.graph
+        stats = {
+            "entities": len(graph),
+            "documents": self.document_count,
+            "graph_version": graph.version,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "requests": self.requests,
+            "errors": self.errors,
+            "view_cache": {"hits": graph.views.hits, "misses": graph.views.misses, "views": len(graph.views.views)},
+        }
+        if search.response_cache is not None:
+            stats["response_cache"] = search.response_cache.stats()
+        return stats
+
+class BadRequest(Exception):
+    pass
+
+def is_integer(value) -> bool:
+    # JSON true and false arrive as bools, which Python counts as ints
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def parse_search_request(body: bytes, default_depth: int,
+                         document_count: int) -> Tuple[str, int, set, Optional[int], int, int, Optional[str]]:
+    try:
+        request = json.loads(body or b"{}")
+    except json.JSONDecodeError as e:
+        raise BadRequest(f"invalid JSON: {e}")
+    if not isinstance(request, dict) or not isinstance(request.get("query"), str) or not request["query"].strip():
+        raise BadRequest("'query' must be a non-empty string")
+    depth = request.get("depth", default_depth)
+    if not is_integer(depth) or depth < 1:
+        raise BadRequest("'depth' must be a positive integer")
+    # Document ids the caller may see; -1 (or leaving it out) means every document. Ids are bounded by the live
+    # graph's documents, since every id becomes a bit of the permission mask (and masks key the view cache)
+    permissions = request.get("permissions", [-1])
+    if not isinstance(permissions, list) or not all(is_integer(doc_id) and -1 <= doc_id < document_count
+                                                    for doc_id in permissions):
+        raise BadRequest(f"'permissions' must be a list of document ids below {document_count} (or -1 for all)")
+    top_k = request.get("top_k", search.DEFAULT_TOP_K)
+    if top_k is not None and (not is_integer(top_k) or top_k < 1):
+        raise BadRequest("'top_k' must be a positive integer or null")
+    # Options taken per model call, and model calls made in parallel per step
+    beam_width = request.get("beam_width", 1)
+    branches = request.get("branches", 1)
+    for name, value in (("beam_width", beam_width), ("branches", branches)):
+        if not is_integer(value) or value < 1:
+            raise BadRequest(f"'{name}' must be a positive integer")
+    fast_path = request.get("fast_path", "seed")
+    if fast_path not in search.FAST_PATH_MODES:
+        raise BadRequest("'fast_path' must be \"seed\", \"answer\" or null")
+    return request["query"], depth, set(permissions), top_k, beam_width, branches, fast_path
+
+def make_handler(service: GraphService, metrics: tracing.MetricsCollector, default_depth: int):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_body(self, status: int, body: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, status: int, payload: dict) -> None:
+            self.send_body(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+        def read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.send_json(200, {"status": "ok", "entities": len(service.graph), "graph_version": service.graph.version})
+            elif self.path == "/stats":
+                self.send_json(200, service.stats())
+            elif self.path == "/metrics":
+                self.send_body(200, metrics.prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+            else:
+                self.send_json(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            body = self.read_body()
+            if self.path == "/search":
+                try:
+                    response = service.search(*parse_search_request(body, default_depth, service.document_count))
+                except BadRequest as e:
+                    service.count(error=True)
+                    self.send_json(400, {"error": str(e)})
+                    return
+                except Exception as e:
+                    service.count(error=True)
+                    self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+                    return
+                service.count()
+                self.send_json(200, response)
+            elif self.path == "/reload":
+                try:
+                    reloaded = service.reload(force=True)
+                except Exception as e:
+                    # The previous graph stays live, as with a failed reload on the watch thread
+                    service.count(error=True)
+                    self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+                    return
+                service.count()
+                self.send_json(200, {"reloaded": reloaded, "graph_version": service.graph.version})
+            else:
+                self.send_json(404, {"error": f"unknown path {self.path}"})
+
+        def log_request(self, code="-", size="-"):
+            # Searches already log plenty; only failed requests are worth a line here
+            if isinstance(code, int) and code >= 400:
+                super().log_request(code, size)
+
+    return Handler
+
+def serve(host: str = "127.0.0.1", port: int = 8000, documents_dir: str = "documents",
+          snapshot_path: Optional[str] = "src/graph_info/graph.snapshot", reload_interval: Optional[float] = 5.0,
+          max_concurrent_requests: Optional[int] = None, default_depth: int = 5, compact: bool = False) -> None:
+    if max_concurrent_requests is not None:
+        set_backend(LimitedBackend(get_backend(), max_concurrent_requests))
+    metrics = tracing.add_hook(tracing.MetricsCollector())
+
+    service = GraphService(documents_dir, snapshot_path, compact=compact)
+    service.reload(force=True)
+    if reload_interval:
+        service.watch(reload_interval)
+
+    server = ThreadingHTTPServer((host, port), make_handler(service, metrics, default_depth))
+    server.daemon_threads = True
+    print(f"Serving {len(service.graph)} entities on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve knowledge graph searches over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--documents", default="documents")
+    parser.add_argument("--snapshot", default="src/graph_info/graph.snapshot")
+    parser.add_argument("--reload-interval", type=float, default=5.0, help="seconds between document checks (0 to disable)")
+    parser.add_argument("--max-concurrent-requests", type=int, default=None, help="cap on in-flight LLM requests")
+    parser.add_argument("--depth", type=int, default=5, help="search depth when a request doesn't give one")
+    parser.add_argument("--compact", action="store_true", help="serve a compact read-only graph (less memory for large graphs)")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.documents, args.snapshot, args.reload_interval, args.max_concurrent_requests, args.depth,
+          args.compact)
+
+if __name__ == "__main__":
+    main()
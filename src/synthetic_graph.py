@@ -0,0 +1,58 @@
+import random
+from itertools import accumulate
+from typing import Dict, List, Optional
+from model.graph import KnowledgeGraph
+from graph_creator import merge_document
+
+RELATIONSHIPS = ["works with", "reports to", "owns", "supplies", "is a customer of", "manages", "is located in",
+                 "partners with", "competes with", "invested in", "was founded by", "is married to"]
+
+FACT_WORDS = ["active", "founded", "large", "regional", "senior", "former", "private", "public", "historic",
+              "growing", "leading", "independent", "annual", "revenue", "budget", "office", "team", "project"]
+
+def entity_weights(num_entities: int, power_law_exponent: Optional[float]) -> List[float]:
+    # Expected degree of each entity. With an exponent the degrees follow a power law (a few hubs with very many
+    # neighbors and a long tail of small nodes, like real extractions); without one every entity is alike.
+    if power_law_exponent is None:
+        return [1.0] * num_entities
+    return [(i + 1) ** (-1 / (power_law_exponent - 1)) for i in range(num_entities)]
+
+def synthetic_extractions(num_entities: int = 1000, avg_degree: float = 4.0, power_law_exponent: Optional[float] = 2.5,
+                          facts_per_node: int = 3, num_documents: int = 10, documents_per_entity: int = 1,
+                          seed: int = 0) -> Dict[int, dict]:
+    # Extraction JSON per document id, shaped like extract_entities_and_relationships output. Each entity is
+    # described in `documents_per_entity` documents, and each relationship comes from one of its source's documents.
+    rng = random.Random(seed)
+    names = [f"Entity {i}" for i in range(num_entities)]
+    entity_documents = [rng.sample(range(num_documents), min(documents_per_entity, num_documents)) for _ in names]
+    extractions = {doc_id: {'entities': [], 'relationships': []} for doc_id in range(num_documents)}
+
+    for name, doc_ids in zip(names, entity_documents):
+        descriptors: Dict[int, List[str]] = {}
+        for _ in range(facts_per_node):
+            descriptors.setdefault(rng.choice(doc_ids), []).append(" ".join(rng.sample(FACT_WORDS, 3)))
+        for doc_id in doc_ids:
+            extractions[doc_id]['entities'].append({'name': name, 'descriptors_not_relationships': descriptors.get(doc_id, [])})
+
+    # Chung-Lu style: both endpoints are drawn in proportion to their weight, so expected degrees follow the weights
+    cumulative = list(accumulate(entity_weights(num_entities, power_law_exponent)))
+    num_relationships = int(num_entities * avg_degree / 2)
+    sources = rng.choices(range(num_entities), cum_weights=cumulative, k=num_relationships)
+    targets = rng.choices(range(num_entities), cum_weights=cumulative, k=num_relationships)
+    for source, target in zip(sources, targets):
+        if source == target:
+            continue
+        extractions[rng.choice(entity_documents[source])]['relationships'].append({
+            'source_entity': names[source],
+            'target_entity': names[target],
+            'relationship_from_source_to_target': rng.choice(RELATIONSHIPS),
+        })
+    return extractions
+
+def synthetic_graph(extractions: Optional[Dict[int, dict]] = None, **kwargs) -> KnowledgeGraph:
+    # Merges synthetic extractions (generated from kwargs if not given) the way create_knowledge_graph does
+    extractions = extractions if extractions is not None else synthetic_extractions(**kwargs)
+    graph = KnowledgeGraph()
+    for doc_id, info_json in extractions.items():
+        merge_document(graph, doc_id, info_json)
+    return graph
@@ -0,0 +1,199 @@
+import contextvars
+import itertools
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, IO, Iterator, List, Optional, Tuple, TypeVar, Union
+
+T = TypeVar("T")
+
+class Span:
+    # One timed phase of ingestion or search. Spans nest: every span started inside another (on the same thread,
+    # or in work handed off with propagate) shares its trace_id and records it as parent_id.
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attributes")
+
+    def __init__(self, name: str, trace_id: str, span_id: int, parent_id: Optional[int], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start": self.start, "duration": self.duration, "attributes": self.attributes}
+
+# A hook is called with every span as it finishes
+Hook = Callable[[Span], None]
+
+_hooks: List[Hook] = []
+_hooks_lock = threading.Lock()
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+def add_hook(hook: Hook) -> Hook:
+    with _hooks_lock:
+        _hooks.append(hook)
+    return hook
+
+def remove_hook(hook: Hook) -> None:
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+def _start(name: str, attributes: Dict[str, Any]) -> Span:
+    parent = _current.get()
+    return Span(name, parent.trace_id if parent is not None else uuid.uuid4().hex[:16], next(_span_ids),
+                parent.span_id if parent is not None else None, attributes)
+
+def _finish(current: Span) -> None:
+    current.end = time.time()
+    for hook in list(_hooks):
+        hook(current)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    # Times the block as a child of the current span; attributes can be added while it runs with span.set
+    current = _start(name, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        _finish(current)
+
+def span_steps(name: str, steps: Iterator[T], **attributes: Any) -> Iterator[T]:
+    # Times a generator as one span. A span block can't be held open across yields: the consumer's own spans
+    # would nest under it, and closing the generator from another context couldn't reset it. Here the span is
+    # only current while the generator runs (so spans it starts are its children, and current_span() inside
+    # it is this span), and it finishes when the generator is exhausted or closed.
+    current = _start(name, attributes)
+    try:
+        while True:
+            token = _current.set(current)
+            try:
+                item = next(steps)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield item
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        close = getattr(steps, "close", None)
+        if close is not None:
+            token = _current.set(current)
+            try:
+                close()
+            finally:
+                _current.reset(token)
+        _finish(current)
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+def annotate(**attributes: Any) -> None:
+    # Adds attributes to the current span, if there is one (lets deep code like backends report token counts)
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+def propagate(fn: Callable[..., T]) -> Callable[..., T]:
+    # Wraps fn to run in a copy of the caller's context, so spans it starts on a worker thread join the caller's trace
+    context = contextvars.copy_context()
+    def run(*args, **kwargs) -> T:
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+class JsonLinesExporter:
+    # Hook that writes every finished span as one JSON object per line
+    def __init__(self, target: Union[str, IO[str]]):
+        self._file = open(target, "a") if isinstance(target, str) else target
+        self._owned = isinstance(target, str)
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._owned:
+            self._file.close()
+
+# Numeric span attributes that are summed into counters
+COUNTED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "options", "pruned")
+
+class MetricsCollector:
+    # Hook that aggregates spans into counters: time and count per span name, the COUNTED_ATTRIBUTES per span
+    # name, and cache hits and misses for spans that report cache_hit
+    def __init__(self, prefix: str = "theseus"):
+        self.prefix = prefix
+        self.span_counts: Dict[str, int] = {}
+        self.span_seconds: Dict[str, float] = {}
+        self.span_errors: Dict[str, int] = {}
+        self.counters: Dict[Tuple[str, str], float] = {}
+        self.cache_lookups: Dict[Tuple[str, bool], int] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span) -> None:
+        with self._lock:
+            self.span_counts[span.name] = self.span_counts.get(span.name, 0) + 1
+            self.span_seconds[span.name] = self.span_seconds.get(span.name, 0.0) + span.duration
+            if "error" in span.attributes:
+                self.span_errors[span.name] = self.span_errors.get(span.name, 0) + 1
+            for attribute in COUNTED_ATTRIBUTES:
+                value = span.attributes.get(attribute)
+                if value is not None:
+                    key = (attribute, span.name)
+                    self.counters[key] = self.counters.get(key, 0) + value
+            hit = span.attributes.get("cache_hit")
+            if hit is not None:
+                key = (span.name, bool(hit))
+                self.cache_lookups[key] = self.cache_lookups.get(key, 0) + 1
+
+    def cache_hit_rate(self, name: str) -> float:
+        with self._lock:
+            hits = self.cache_lookups.get((name, True), 0)
+            lookups = hits + self.cache_lookups.get((name, False), 0)
+        return hits / lookups if lookups else 0.0
+
+    def prometheus(self) -> str:
+        # Prometheus text exposition format
+        p = self.prefix
+        with self._lock:
+            lines = [f"# TYPE {p}_span_seconds summary"]
+            for name in sorted(self.span_counts):
+                lines.append(f'{p}_span_seconds_count{{span="{name}"}} {self.span_counts[name]}')
+                lines.append(f'{p}_span_seconds_sum{{span="{name}"}} {self.span_seconds[name]:.6f}')
+            lines.append(f"# TYPE {p}_span_errors_total counter")
+            for name in sorted(self.span_errors):
+                lines.append(f'{p}_span_errors_total{{span="{name}"}} {self.span_errors[name]}')
+            for attribute in COUNTED_ATTRIBUTES:
+                lines.append(f"# TYPE {p}_{attribute}_total counter")
+                for (counted, name), value in sorted(self.counters.items()):
+                    if counted == attribute:
+                        lines.append(f'{p}_{attribute}_total{{span="{name}"}} {value:g}')
+            lines.append(f"# TYPE {p}_cache_lookups_total counter")
+            for (name, hit), count in sorted(self.cache_lookups.items()):
+                lines.append(f'{p}_cache_lookups_total{{span="{name}",result="{"hit" if hit else "miss"}"}} {count}')
+        return "\n".join(lines) + "\n"
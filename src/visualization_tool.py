@@ -1,38 +1,137 @@
 import tkinter as tk
-from tkinter import ttk
+from tkinter import filedialog, ttk
 import networkx as nx
 import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from typing import Dict
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.figure import Figure
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from model.graph import KnowledgeGraph, derived_data
 from model.node import Node
 from model.relationship import Relationship
 from model.path import Path
-from search import search
+from model.graph_view import permitted_view
+from extraction_cache import ExtractionCache
+from search import PathsFound, SearchStep, SourceSelected, print_step, search_steps
+import hashlib
+import html
+import io
+import json
 import os
-
-def get_knowledge_graph(graph: Dict[str, 'Node'], history: list[str, Path], permissions: set[int], ax=None):
-    # Create a NetworkX graph
-    G = nx.DiGraph()
-
-    # Add nodes and edges to the graph
-    for node_name, node in graph.items():
-        G.add_node(node_name)
-        for target_node, relationships in node.edges.items():
-            for relationship in relationships:
-                G.add_edge(node_name, target_node.name, label=relationship.information)
-
-    # Create a matplotlib figure and axis if not provided
-    if ax is None:
-        fig, ax = plt.subplots(figsize=(14, 10))
-    else:
-        fig = ax.figure
-
-    # Use a spring layout for the entire graph, spaced out to fill the screen
-    pos = nx.spring_layout(G, k=1.5, iterations=50)
-    # Scale the layout to fit the entire screen
-    pos = {node: (x*2-1, y*2-1) for node, (x, y) in pos.items()}
-
-    # Color nodes and edges based on the final path and permissions
+import queue
+import threading
+import time
+
+# Spring layouts of earlier graphs, so restarting the GUI on an unchanged graph skips the layout entirely. They are
+# stored like extraction results (atomic writes, least recently used evicted) and bounded to LAYOUT_CACHE_MAX_BYTES.
+LAYOUT_CACHE_DIR = "src/graph_info/layouts"
+LAYOUT_CACHE_MAX_BYTES = 64 * 2 ** 20
+LAYOUT_ITERATIONS = 50
+
+# Graphs up to this size are drawn whole; larger ones only around the search path or a chosen entity
+FULL_GRAPH_LIMIT = 150
+NEIGHBORHOOD_HOPS = 2
+MAX_VISIBLE_NODES = 80
+# Facts are listed in full when at most this many nodes are drawn (or zoomed in on), otherwise only counted
+FULL_DETAIL_NODES = 25
+
+def neighborhood(graph: Dict[str, 'Node'], centers: Iterable[str], hops: int = NEIGHBORHOOD_HOPS,
+                 max_nodes: Optional[int] = MAX_VISIBLE_NODES) -> List[str]:
+    # Names within `hops` edges of the centers, nearest first, stopping at max_nodes
+    names = [name for name in dict.fromkeys(centers) if name in graph]
+    seen = set(names)
+    layer = names
+    for _ in range(hops):
+        next_layer = []
+        for name in layer:
+            for target_node in graph[name].edges:
+                if max_nodes is not None and len(names) >= max_nodes:
+                    return names
+                if target_node.name not in seen and target_node.name in graph:
+                    seen.add(target_node.name)
+                    names.append(target_node.name)
+                    next_layer.append(target_node.name)
+        layer = next_layer
+    return names
+
+def neighborhood_graph(graph: Dict[str, 'Node'], names: Iterable[str]) -> KnowledgeGraph:
+    # Copy of just these nodes and the edges between them, so drawing costs what is visible, not the whole graph
+    subgraph = KnowledgeGraph()
+    for name in names:
+        node = graph[name]
+        copy = Node(name)
+        copy.documents = set(node.documents)
+        copy.document_mask = node.document_mask
+        copy.facts = {doc_id: set(facts) for doc_id, facts in node.facts.items()}
+        subgraph[name] = copy
+    for name, copy in subgraph.items():
+        for target_node, relationships in graph[name].edges.items():
+            if target_node.name in subgraph:
+                for rel in relationships:
+                    copy.add_relationship(subgraph[target_node.name], rel)
+    subgraph.rebuild_document_index()
+    subgraph.version = getattr(graph, 'version', 0)
+    return subgraph
+
+def focus_centers(graph: Dict[str, 'Node'], history: list[str, Path], focus: Optional[str]) -> List[str]:
+    # What a neighborhood is drawn around: the chosen entity, else the nodes on the search paths, else the biggest hub
+    if focus is not None and focus in graph:
+        return [focus]
+    if history:
+        return [node.name for _, path in history for node in path.get_nodes()]
+    return [max(graph, key=lambda name: len(graph[name].edges))] if graph else []
+
+def build_networkx_graph(graph: Dict[str, 'Node']) -> nx.DiGraph:
+    # Built once per graph version (see derived_data)
+    def build(_) -> nx.DiGraph:
+        G = nx.DiGraph()
+        for node_name, node in graph.items():
+            G.add_node(node_name)
+            for target_node, relationships in node.edges.items():
+                for relationship in relationships:
+                    G.add_edge(node_name, target_node.name, label=relationship.information)
+        return G
+    return derived_data(graph, 'networkx_graph', build)
+
+def layout_key(G: nx.DiGraph) -> str:
+    # Identifies the graph's structure (layouts only depend on nodes and edges)
+    digest = hashlib.sha256(f"k=1.5,iterations={LAYOUT_ITERATIONS}\n".encode("utf-8"))
+    for node in sorted(G.nodes()):
+        digest.update(f"n{len(node)}:{node}".encode("utf-8"))
+    for source, target in sorted(G.edges()):
+        digest.update(f"e{len(source)}:{source}{len(target)}:{target}".encode("utf-8"))
+    return digest.hexdigest()
+
+def graph_layout(graph: Dict[str, 'Node'], G: nx.DiGraph, cache_dir: Optional[str] = LAYOUT_CACHE_DIR) -> Dict[str, Tuple[float, float]]:
+    # Node positions, computed once per graph version (in memory, see derived_data) and per graph structure (on disk)
+    return derived_data(graph, 'layout', lambda previous: compute_layout(G, previous, cache_dir))
+
+def compute_layout(G: nx.DiGraph, previous: Optional[Dict[str, Tuple[float, float]]],
+                   cache_dir: Optional[str]) -> Dict[str, Tuple[float, float]]:
+    cache = ExtractionCache(cache_dir) if cache_dir is not None else None
+    key = layout_key(G) if cache is not None else None
+    pos = None
+    stored = cache.get(key) if cache is not None else None
+    if stored is not None:
+        try:
+            pos = {node: (float(x), float(y)) for node, (x, y) in stored.items()}
+        except (AttributeError, TypeError, ValueError):
+            # Not a layout; lay the graph out again and overwrite it
+            pos = None
+    if pos is None or set(pos) != set(G.nodes()):
+        # After an edit, start from the previous positions so the picture stays recognizable
+        initial = {node: ((x + 1) / 2, (y + 1) / 2) for node, (x, y) in previous.items() if node in G} if previous else None
+        # Use a spring layout for the entire graph, spaced out to fill the screen
+        pos = nx.spring_layout(G, k=1.5, iterations=LAYOUT_ITERATIONS, pos=initial or None, seed=0)
+        # Scale the layout to fit the entire screen
+        pos = {node: (float(x) * 2 - 1, float(y) * 2 - 1) for node, (x, y) in pos.items()}
+        if cache is not None:
+            cache.put(key, json.dumps(pos))
+            cache.evict(max_bytes=LAYOUT_CACHE_MAX_BYTES)
+    return pos
+
+def graph_colors(graph: Dict[str, 'Node'], G: nx.DiGraph, history: list[str, Path], permissions: set[int]) -> Tuple[List[str], List[str]]:
+    # Node and edge colors (in G.nodes() and G.edges() order) for a search history and permission set
     node_colors = {}
     edge_colors = {}
     if history:
@@ -41,9 +140,10 @@ def get_knowledge_graph(graph: Dict[str, 'Node'], history: list[str, Path], perm
             for node in path_nodes:
                 node_colors[node.name] = 'green'
             
-            for i in range(0, len(path[1].elements) - 1, 2):
-                source = path[1].elements[i].name
-                target = path[1].elements[i+2].name
+            path_elements = path[1].elements
+            for i in range(0, len(path_elements) - 1, 2):
+                source = path_elements[i].name
+                target = path_elements[i+2].name
                 edge_colors[(source, target)] = 'green'
         
         # Color the final path
@@ -57,15 +157,17 @@ def get_knowledge_graph(graph: Dict[str, 'Node'], history: list[str, Path], perm
             else:
                 node_colors[node.name] = 'green'
         
-        for i in range(0, len(final_path.elements) - 1, 2):
-            source = final_path.elements[i].name
-            target = final_path.elements[i+2].name
+        final_elements = final_path.elements
+        for i in range(0, len(final_elements) - 1, 2):
+            source = final_elements[i].name
+            target = final_elements[i+2].name
             edge_colors[(source, target)] = 'green'
 
-    # Color nodes and edges based on permissions
+    # Color nodes and edges based on permissions, using the cached view of what they can see
+    view = permitted_view(graph, permissions)
     for node_name, node in graph.items():
         if node_name not in node_colors:
-            if -1 in permissions or any(doc in permissions for doc in node.documents):
+            if node_name in view:
                 node_colors[node_name] = 'lightblue'
             else:
                 node_colors[node_name] = 'lightgray'
@@ -73,47 +175,225 @@ def get_knowledge_graph(graph: Dict[str, 'Node'], history: list[str, Path], perm
     for edge in G.edges():
         if edge not in edge_colors:
             source, target = edge
-            relationships = graph[source].edges[graph[target]]
-            if -1 in permissions or any(rel.document_source in permissions for rel in relationships):
+            if source in view and target in view and view[target] in view[source].edges:
                 edge_colors[edge] = 'lightblue'
             else:
                 edge_colors[edge] = 'lightgray'
 
-    # Draw the graph with colored nodes and edges
-    nx.draw(G, pos, with_labels=True, 
-            node_color=[node_colors.get(node, 'lightblue') for node in G.nodes()],
-            edge_color=[edge_colors.get(edge, 'gray') for edge in G.edges()],
-            node_size=4000, font_size=10, font_weight='bold', 
-            linewidths=1.5, arrows=True, arrowsize=20, ax=ax)
-
-    # Draw edge labels
-    edge_labels = nx.get_edge_attributes(G, 'label')
-    nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels, label_pos=0.5, font_size=8, font_color='black', ax=ax)
-
-    # Add node information as text
-    for node_name, node in graph.items():
-        x, y = pos[node_name]
-        ax.text(x, y+0.1, f"Docs: {', '.join(map(str, node.documents))}", ha='center', va='center', bbox=dict(facecolor='white', edgecolor='none', alpha=0.7), fontsize=8)
-        
-        fact_lines = [f"{fact} (Doc: {doc_id})" for doc_id, facts in node.facts.items() for fact in facts]
-        fact_text = "\n".join(fact_lines)
-        ax.text(x, y-0.1, fact_text, ha='center', va='top', bbox=dict(facecolor='white', edgecolor='none', alpha=0.7), fontsize=8)
+    return ([node_colors.get(node, 'lightblue') for node in G.nodes()],
+            [edge_colors.get(edge, 'gray') for edge in G.edges()])
+
+class GraphFigure:
+    # The graph drawn once on an axis. Searches and permission changes only recolor the existing node and
+    # edge artists, instead of laying out and drawing every node, label and fact box again.
+    # With detail="counts" each node only shows how many facts it has; the full list appears when hovering
+    # over the node or zooming in until at most FULL_DETAIL_NODES nodes are in view.
+    def __init__(self, graph: Dict[str, 'Node'], ax, detail: str = "full"):
+        self.graph = graph
+        self.version = getattr(graph, 'version', None)
+        self.ax = ax
+        self.detail = detail
+        self.G = build_networkx_graph(graph)
+        self.pos = pos = graph_layout(graph, self.G)
+        self.node_names = list(self.G.nodes())
+
+        # Draw the graph, recording the artists whose colors change later
+        self.nodes = nx.draw_networkx_nodes(self.G, pos, nodelist=self.node_names, node_color='lightblue',
+                                            node_size=4000, linewidths=1.5, ax=ax)
+        self.edges = nx.draw_networkx_edges(self.G, pos, edgelist=list(self.G.edges()), edge_color='gray',
+                                            node_size=4000, arrows=True, arrowsize=20, ax=ax)
+        nx.draw_networkx_labels(self.G, pos, font_size=10, font_weight='bold', ax=ax)
+
+        # Draw edge labels
+        edge_labels = nx.get_edge_attributes(self.G, 'label')
+        nx.draw_networkx_edge_labels(self.G, pos, edge_labels=edge_labels, label_pos=0.5, font_size=8, font_color='black', ax=ax)
+
+        # Add node information as text
+        self.fact_texts = {}
+        for node_name, node in graph.items():
+            x, y = pos[node_name]
+            ax.text(x, y+0.1, f"Docs: {', '.join(map(str, node.documents))}", ha='center', va='center', bbox=dict(facecolor='white', edgecolor='none', alpha=0.7), fontsize=8)
+            
+            fact_text = self.fact_text(node_name) if detail == "full" else self.fact_count(node_name)
+            self.fact_texts[node_name] = ax.text(x, y-0.1, fact_text, ha='center', va='top', bbox=dict(facecolor='white', edgecolor='none', alpha=0.7), fontsize=8)
+
+        ax.set_title("Knowledge Graph Visualization", fontsize=14)
+        ax.axis('off')
+
+        # Callback ids, so disconnect can remove the handlers when the figure is replaced
+        self.canvas_cids = []
+        self.axes_cids = []
+        if detail == "counts":
+            self.tooltip = ax.annotate("", xy=(0, 0), xytext=(15, 15), textcoords='offset points', fontsize=8, zorder=10,
+                                       bbox=dict(facecolor='lightyellow', edgecolor='gray'), visible=False)
+            self.hovered = None
+            self.expanded = set()
+            self.canvas_cids.append(ax.figure.canvas.mpl_connect('motion_notify_event', self.on_hover))
+            self.axes_cids.append(ax.callbacks.connect('xlim_changed', self.on_zoom))
+            self.axes_cids.append(ax.callbacks.connect('ylim_changed', self.on_zoom))
+
+    def disconnect(self) -> None:
+        # The canvas outlives the figure drawn on it, so its handlers have to be removed explicitly
+        for cid in self.canvas_cids:
+            self.ax.figure.canvas.mpl_disconnect(cid)
+        for cid in self.axes_cids:
+            self.ax.callbacks.disconnect(cid)
+        self.canvas_cids, self.axes_cids = [], []
+
+    def fact_text(self, node_name: str) -> str:
+        node = self.graph[node_name]
+        return "\n".join(f"{fact} (Doc: {doc_id})" for doc_id, facts in node.facts.items() for fact in facts)
+
+    def fact_count(self, node_name: str) -> str:
+        count = sum(len(facts) for facts in self.graph[node_name].facts.values())
+        return f"{count} fact{'s' if count != 1 else ''}" if count else ""
+
+    def on_hover(self, event) -> None:
+        hovered = None
+        if event.inaxes is self.ax:
+            contains, info = self.nodes.contains(event)
+            if contains:
+                hovered = self.node_names[info['ind'][0]]
+        if hovered == self.hovered:
+            return
+        self.hovered = hovered
+        if hovered is not None:
+            self.tooltip.xy = self.pos[hovered]
+            self.tooltip.set_text(f"{hovered}\n{self.fact_text(hovered)}".strip())
+        self.tooltip.set_visible(hovered is not None)
+        self.ax.figure.canvas.draw_idle()
+
+    def on_zoom(self, ax) -> None:
+        # Expand the facts of the nodes in view once few enough are, and collapse the rest again
+        (x0, x1), (y0, y1) = sorted(ax.get_xlim()), sorted(ax.get_ylim())
+        in_view = {name for name, (x, y) in self.pos.items() if x0 <= x <= x1 and y0 <= y <= y1}
+        expanded = in_view if len(in_view) <= FULL_DETAIL_NODES else set()
+        for name in expanded ^ self.expanded:
+            self.fact_texts[name].set_text(self.fact_text(name) if name in expanded else self.fact_count(name))
+        self.expanded = expanded
+
+    def is_current(self, graph: Dict[str, 'Node']) -> bool:
+        return graph is self.graph and getattr(graph, 'version', None) == self.version
+
+    def recolor(self, history: list[str, Path], permissions: set[int]) -> None:
+        node_colors, edge_colors = graph_colors(self.graph, self.G, history, permissions)
+        self.nodes.set_facecolor(node_colors)
+        for edge, color in zip(self.edges, edge_colors):
+            edge.set_color(color)
 
-    ax.set_title("Knowledge Graph Visualization", fontsize=14)
-    ax.axis('off')
+def get_knowledge_graph(graph: Dict[str, 'Node'], history: list[str, Path], permissions: set[int], ax=None):
+    # Create a matplotlib figure and axis if not provided
+    if ax is None:
+        fig, ax = plt.subplots(figsize=(14, 10))
+    else:
+        fig = ax.figure
 
+    GraphFigure(graph, ax).recolor(history, permissions)
     return fig
 
+def visible_graph(graph: Dict[str, 'Node'], history: list[str, Path], focus: Optional[str] = None,
+                  hops: int = NEIGHBORHOOD_HOPS) -> Dict[str, 'Node']:
+    # The part of the graph worth drawing: all of a small graph, or the neighborhood of the focus or search path
+    if focus is None and len(graph) <= FULL_GRAPH_LIMIT:
+        return graph
+    return neighborhood_graph(graph, neighborhood(graph, focus_centers(graph, history, focus), hops))
+
+def show_graph(graph_tab, graph: Dict[str, 'Node'], history: list[str, Path], permissions: set[int]) -> None:
+    # Recolors the graph tab's figure, only drawing it from scratch the first time or when what is visible changed
+    graph_tab.history, graph_tab.permissions = history, permissions
+    drawn = visible_graph(graph, history, getattr(graph_tab, 'focus', None), getattr(graph_tab, 'hops', NEIGHBORHOOD_HOPS))
+    figure = getattr(graph_tab, 'graph_figure', None)
+    if figure is None or not (figure.is_current(drawn) or (drawn is not graph and figure.graph.keys() == drawn.keys()
+                                                           and figure.version == drawn.version)):
+        if figure is not None:
+            figure.disconnect()
+        graph_tab.canvas.figure.clear()
+        detail = "full" if len(drawn) <= FULL_DETAIL_NODES else "counts"
+        figure = graph_tab.graph_figure = GraphFigure(drawn, graph_tab.canvas.figure.add_subplot(111), detail)
+    figure.recolor(history, permissions)
+    graph_tab.canvas.draw_idle()
+
+def export_graph(graph: Dict[str, 'Node'], path: str, history: list[str, Path] = None, permissions: set[int] = {-1},
+                 focus: Optional[str] = None, hops: int = NEIGHBORHOOD_HOPS) -> str:
+    # Writes the visible part of the graph to an .svg/.png/.pdf image, or to an .html page with the image
+    # followed by every drawn entity's facts. Uses no pyplot state, so it is safe to run off the Tk thread.
+    drawn = visible_graph(graph, history, focus, hops)
+    fig = Figure(figsize=(14, 10))
+    GraphFigure(drawn, fig.add_subplot(111), "full" if len(drawn) <= FULL_DETAIL_NODES else "counts").recolor(history, permissions)
+    if not path.endswith(".html"):
+        fig.savefig(path)
+        return path
+
+    svg = io.StringIO()
+    fig.savefig(svg, format="svg")
+    entities = []
+    for name, node in sorted(drawn.items()):
+        facts = "".join(f"<li>{html.escape(fact)} (Doc: {doc_id})</li>" for doc_id, facts in sorted(node.facts.items()) for fact in sorted(facts))
+        count = sum(len(facts) for facts in node.facts.values())
+        entities.append(f"<details><summary>{html.escape(name)} ({count} facts)</summary><ul>{facts}</ul></details>")
+    with open(path, "w") as f:
+        f.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Knowledge Graph</title></head><body>\n"
+                f"{svg.getvalue()[svg.getvalue().index('<svg'):]}\n<h2>Entities</h2>\n" + "\n".join(entities) + "\n</body></html>\n")
+    return path
+
+# One export at a time in the background, so large exports never block the interface
+_export_executor = ThreadPoolExecutor(max_workers=1)
+
+def export_graph_async(graph: Dict[str, 'Node'], path: str, history: list[str, Path] = None, permissions: set[int] = {-1},
+                       focus: Optional[str] = None, hops: int = NEIGHBORHOOD_HOPS) -> Future:
+    return _export_executor.submit(export_graph, graph, path, history, permissions, focus, hops)
+
 def create_graph_tab(notebook, graph):
     graph_tab = ttk.Frame(notebook)
     notebook.add(graph_tab, text="Graph")
 
-    fig = get_knowledge_graph(graph, None, {-1})  # Default to full permissions
+    # Large graphs are drawn around a focus entity (or the search path), this many hops out
+    controls = ttk.Frame(graph_tab)
+    controls.pack(fill='x', padx=10, pady=5)
+    tk.Label(controls, text="Focus entity:").pack(side='left')
+    focus_entry = tk.Entry(controls, width=30)
+    focus_entry.pack(side='left', padx=5)
+    tk.Label(controls, text="Hops:").pack(side='left')
+    hops_var = tk.IntVar(value=NEIGHBORHOOD_HOPS)
+    tk.Spinbox(controls, from_=1, to=5, textvariable=hops_var, width=3).pack(side='left', padx=5)
+    status_label = tk.Label(controls, text="")
+
+    def refocus(focus):
+        graph_tab.focus = focus if focus in graph else None
+        graph_tab.hops = hops_var.get()
+        status_label.config(text="" if focus in graph or focus is None else f"No entity named {focus}")
+        show_graph(graph_tab, graph, graph_tab.history, graph_tab.permissions)
+
+    def export():
+        path = filedialog.asksaveasfilename(defaultextension=".svg", filetypes=[("SVG", "*.svg"), ("HTML", "*.html"), ("PNG", "*.png")])
+        if not path:
+            return
+        status_label.config(text=f"Exporting {os.path.basename(path)}...")
+        future = export_graph_async(graph, path, graph_tab.history, graph_tab.permissions, graph_tab.focus, graph_tab.hops)
+
+        def poll():
+            if not future.done():
+                graph_tab.after(200, poll)
+            elif future.exception() is not None:
+                status_label.config(text=f"Export failed: {future.exception()}")
+            else:
+                status_label.config(text=f"Exported {os.path.basename(path)}")
+        poll()
+
+    tk.Button(controls, text="Focus", command=lambda: refocus(focus_entry.get().strip() or None)).pack(side='left', padx=5)
+    tk.Button(controls, text="Clear focus", command=lambda: refocus(None)).pack(side='left', padx=5)
+    tk.Button(controls, text="Export...", command=export).pack(side='left', padx=5)
+    status_label.pack(side='left', padx=10)
+
+    fig = Figure(figsize=(14, 10))
     canvas = FigureCanvasTkAgg(fig, master=graph_tab)
+    graph_tab.canvas = canvas
+    graph_tab.focus = None
+    graph_tab.hops = NEIGHBORHOOD_HOPS
+    show_graph(graph_tab, graph, None, {-1})  # Default to full permissions
     canvas.draw()
+    NavigationToolbar2Tk(canvas, graph_tab).update()
     canvas.get_tk_widget().pack(fill='both', expand=True)
-    graph_tab.canvas = canvas
-    graph_tab.permissions = {-1}  # Initialize with full permissions
 
     return graph_tab
 
@@ -134,6 +414,27 @@ def create_question_tab(notebook, graph, graph_tab):
     depth_spinbox = tk.Spinbox(question_tab, from_=1, to=30, textvariable=depth_var, width=5)
     depth_spinbox.pack(pady=5)
 
+    beam_width_label = tk.Label(question_tab, text="Options explored per step:")
+    beam_width_label.pack(pady=5)
+
+    beam_width_var = tk.IntVar(value=1)
+    beam_width_spinbox = tk.Spinbox(question_tab, from_=1, to=5, textvariable=beam_width_var, width=5)
+    beam_width_spinbox.pack(pady=5)
+
+    branches_label = tk.Label(question_tab, text="Parallel branches:")
+    branches_label.pack(pady=5)
+
+    branches_var = tk.IntVar(value=1)
+    branches_spinbox = tk.Spinbox(question_tab, from_=1, to=8, textvariable=branches_var, width=5)
+    branches_spinbox.pack(pady=5)
+
+    time_limit_label = tk.Label(question_tab, text="Time limit in seconds (0 for none):")
+    time_limit_label.pack(pady=5)
+
+    time_limit_var = tk.IntVar(value=0)
+    time_limit_spinbox = tk.Spinbox(question_tab, from_=0, to=600, textvariable=time_limit_var, width=5)
+    time_limit_spinbox.pack(pady=5)
+
     result_frame = ttk.Frame(question_tab)
     result_frame.pack(fill='both', expand=True, padx=20, pady=20)
 
@@ -152,31 +453,86 @@ def create_question_tab(notebook, graph, graph_tab):
     potential_issues_text = tk.Text(result_frame, height=3, wrap='word')
     potential_issues_text.pack(fill='x', pady=5)
 
-    def submit_question():
-        query = question_entry.get()
-        depth = depth_var.get()
-        permissions = getattr(question_tab, 'permissions', {-1})
-        result, history = search(graph, query, depth, permissions)
+    status_label = tk.Label(question_tab, text="")
+    status_label.pack(pady=5)
+
+    def show_result(result, history, permissions):
         best_guess_text.delete('1.0', tk.END)
         best_guess_text.insert(tk.END, result.best_guess)
         positive_explanation_text.delete('1.0', tk.END)
         positive_explanation_text.insert(tk.END, result.positive_explation)
         potential_issues_text.delete('1.0', tk.END)
         potential_issues_text.insert(tk.END, result.potential_issues)
-        
+
         print("Updating graph visualization...")
         if hasattr(graph_tab, 'canvas'):
-            graph_tab.canvas.figure.clear()
-            ax = graph_tab.canvas.figure.add_subplot(111)
-            get_knowledge_graph(graph, history, permissions, ax)
-            graph_tab.canvas.draw()
+            show_graph(graph_tab, graph, history, permissions)
             print("REDREW")
         else:
             print("No canvas attribute found in graph_tab")
 
+    def submit_question():
+        query = question_entry.get()
+        depth = depth_var.get()
+        beam_width = beam_width_var.get()
+        branches = branches_var.get()
+        permissions = getattr(question_tab, 'permissions', {-1})
+        time_limit = time_limit_var.get()
+        deadline = time.time() + time_limit if time_limit > 0 else None
+
+        # The search runs on a worker thread and reports through a queue, since Tk may only be touched from this thread
+        cancel = threading.Event()
+        events = queue.Queue()
+        question_tab.cancel = cancel
+
+        def run_search():
+            try:
+                for event in search_steps(graph, query, depth, permissions, cancel=cancel, deadline=deadline,
+                                          beam_width=beam_width, branches=branches):
+                    events.put(event)
+            except Exception as e:
+                events.put(e)
+
+        def poll():
+            while not events.empty():
+                event = events.get()
+                if isinstance(event, Exception):
+                    status_label.config(text=f"Search failed: {event}")
+                    submit_button.config(state='normal')
+                    return
+                if isinstance(event, SourceSelected):
+                    status_label.config(text=f"Starting from {event.source}...")
+                elif isinstance(event, PathsFound):
+                    status_label.config(text=f"Starting from {len(event.paths)} paths connecting {', '.join(event.entities)}...")
+                elif isinstance(event, SearchStep):
+                    status_label.config(text=f"Step {event.step + 1}: {', '.join(path.last_node().name for path in event.paths)}")
+                    print_step(event)
+                else:
+                    submit_button.config(state='normal')
+                    if event.result is None:
+                        status_label.config(text="Search cancelled")
+                    else:
+                        status_label.config(text="Stopped at the time limit" if event.stopped == "deadline" else "Done")
+                        show_result(event.result, event.history, permissions)
+                    return
+            question_tab.after(100, poll)
+
+        submit_button.config(state='disabled')
+        status_label.config(text="Searching...")
+        threading.Thread(target=run_search, daemon=True).start()
+        question_tab.after(100, poll)
+
+    def cancel_question():
+        cancel = getattr(question_tab, 'cancel', None)
+        if cancel is not None:
+            cancel.set()
+
     submit_button = tk.Button(question_tab, text="Submit", command=submit_question)
     submit_button.pack(pady=10)
 
+    cancel_button = tk.Button(question_tab, text="Cancel", command=cancel_question)
+    cancel_button.pack(pady=5)
+
     return question_tab
 
 def create_third_tab(notebook, graph_tab, question_tab, graph):
@@ -192,7 +548,7 @@ def create_third_tab(notebook, graph_tab, question_tab, graph):
     global_checkbox = tk.Checkbutton(third_tab, text="Global Permissions", variable=global_var)
     global_checkbox.pack(anchor='w', padx=20, pady=10)
 
-    for filename in os.listdir(documents_dir):
+    for filename in sorted(os.listdir(documents_dir)):
         if filename.endswith(".txt"):
             var = tk.IntVar()
             checkbox = tk.Checkbutton(third_tab, text=filename, variable=var)
@@ -221,10 +577,7 @@ def create_third_tab(notebook, graph_tab, question_tab, graph):
 
 def update_graph(graph_tab, graph, permissions):
     if hasattr(graph_tab, 'canvas'):
-        graph_tab.canvas.figure.clear()
-        ax = graph_tab.canvas.figure.add_subplot(111)
-        get_knowledge_graph(graph, None, permissions, ax)
-        graph_tab.canvas.draw()
+        show_graph(graph_tab, graph, None, permissions)
         print("Graph updated with new permissions")
     else:
         print("No canvas attribute found in graph_tab")